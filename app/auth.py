@@ -1,3 +1,4 @@
+import os
 import sqlite3
 from passlib.context import CryptContext
 from datetime import datetime, timedelta, timezone
@@ -9,14 +10,21 @@ from fastapi.security import OAuth2PasswordBearer
 context = CryptContext(schemes=["bcrypt"])
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
+# A relative USERS_DB_PATH is resolved against the project root rather than the working directory, so every
+# worker opens the same file however it was started
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USERS_DB_FILE = os.path.join(PROJECT_ROOT, settings.USERS_DB_PATH)
+
 def get_db():
     '''
-    Establishes a connection to the SQLite database and returns the connection object. The database file is named 'users.db'.
+    Establishes a connection to the SQLite database and returns the connection object. The database file is located at USERS_DB_PATH.
+    WAL journaling and a busy timeout let several worker processes share the file safely.
     '''
     
-    conn = sqlite3.connect('users.db')
+    conn = sqlite3.connect(USERS_DB_FILE, timeout=30)
 
     if conn is not None:
+        conn.execute('PRAGMA journal_mode=WAL')
         cursor = conn.cursor()
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -1,3 +1,4 @@
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -15,8 +16,28 @@ class Settings(BaseSettings):
     OPENAI_API_KEY: str  # loaded from .env
     OPENAI_MODEL: str = "gpt-5-nano"
     CHROMA_DB_DIR: str = "./chroma_db" # Directory for ChromaDB storage
+    CHROMA_HOST: Optional[str] = None # Host of a ChromaDB server; when set, clients connect over HTTP instead of embedding ChromaDB
+    CHROMA_PORT: int = 8000 # Port of the ChromaDB server
+    USERS_DB_PATH: str = "./users.db" # SQLite database holding user accounts; relative paths are resolved against the project root
     EMBEDDING_MODEL: str = "all-MiniLM-L6-v2" # SentenceTransformer model for generating embeddings
     CHUNK_SIZE: int = 1000 # Default chunk size for document processing
     MAX_CRAWL_DEPTH: int = 3 # Default maximum crawl depth for recursive crawling
+    MAX_CRAWL_SLOTS: int = 20 # Max pages fetched at once across all crawl requests of a process
+    MAX_CRAWL_SLOTS_PER_USER: int = 10 # Max pages fetched at once across all crawl requests of one user
+    CRAWL_MEMORY_THRESHOLD_PERCENT: float = 70.0 # No new page fetches start while system memory use is above this
+    PAGE_STORE_DIR: Optional[str] = None # Directory for temporary crawled page stores; system temp dir if unset
+    APP_ROLE: str = "all" # Routers to serve: "all", "crawl" (crawl-only) or "chat" (chat-only); heavy modules of other roles are never imported
+    WARMUP_EMBEDDING_MODEL: bool = True # Load the embedding model during startup instead of on the first request
+    WARMUP_COLLECTIONS: list[str] = [] # Collections to open and query once during startup
+    WARMUP_BROWSER: bool = False # Launch the headless browser once during startup (crawl roles only)
+    BATCH_MAX_LLM_CONCURRENCY: int = 8 # Max LLM calls in flight for one /chat/batch request
+    RERANK_ENABLED: bool = False # Rerank retrieved chunks with a cross-encoder before building the prompt
+    RERANK_MODEL: str = "cross-encoder/ms-marco-MiniLM-L-6-v2" # Small CPU-friendly cross-encoder used for reranking
+    RERANK_FETCH_MULTIPLIER: int = 4 # Number of candidates fetched per requested result when reranking
+    RERANK_MAX_CANDIDATES: int = 50 # Hard cap on candidates scored per query
+    RERANK_BATCH_SIZE: int = 16 # Batch size for cross-encoder inference
+    RERANK_LATENCY_BUDGET_MS: float = 300.0 # Skip reranking when the estimated scoring time exceeds this budget
+    RERANK_CACHE_SIZE: int = 10000 # Max number of cached (query, chunk) scores
+    RERANK_PROBE_INTERVAL_SECONDS: float = 30.0 # While over budget, rerank one query this often to re-measure latency
 
 settings = Settings()
\ No newline at end of file
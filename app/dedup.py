@@ -0,0 +1,268 @@
+"""URL canonicalization, near-duplicate page detection and boilerplate removal for crawl results."""
+
+import hashlib
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl, urldefrag, urlencode, urljoin, urlparse, urlunparse
+
+import numpy as np
+
+from app.page_store import PageHandle, PageStore
+
+# Query parameters that never change page content: tracking, session and print/share variants.
+IGNORED_QUERY_PARAMS = {
+    "gclid", "fbclid", "msclkid", "dclid", "yclid", "mc_cid", "mc_eid", "_ga", "_gl",
+    "ref", "ref_src", "share", "print",
+    "sessionid", "session_id", "sid", "phpsessid", "jsessionid",
+}
+IGNORED_QUERY_PREFIXES = ("utm_",)
+DEFAULT_PORTS = {"http": 80, "https": 443}
+INDEX_PAGES = ("index.html", "index.htm", "index.php")
+
+SIMHASH_BITS = 64
+SHINGLE_SIZE = 3
+
+
+def canonicalize_url(url: str) -> str:
+    """Normalize a URL so that trivially different variants of the same page compare equal.
+
+    Drops the fragment, lowercases scheme and host, removes default ports, tracking/session/print
+    query parameters and index page names, sorts the remaining query parameters and strips the
+    trailing slash from non-root paths.
+    """
+    url = urldefrag(url)[0]
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or "").lower()
+    if parsed.port and parsed.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parsed.port}"
+
+    path = parsed.path or "/"
+    for index_page in INDEX_PAGES:
+        if path.endswith("/" + index_page):
+            path = path[: -len(index_page)]
+    if len(path) > 1:
+        path = path.rstrip("/") or "/"
+
+    query = sorted(
+        (key, value)
+        for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+        if key.lower() not in IGNORED_QUERY_PARAMS and not key.lower().startswith(IGNORED_QUERY_PREFIXES)
+    )
+    return urlunparse((scheme, host, path, "", urlencode(query), ""))
+
+
+_LINK_TAG = re.compile(r"<link\b[^>]*>", re.IGNORECASE)
+_REL_CANONICAL = re.compile(r"""\brel\s*=\s*["']?[^"'>]*\bcanonical\b""", re.IGNORECASE)
+_HREF = re.compile(r"""\bhref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.IGNORECASE)
+
+
+def extract_canonical_url(html: Optional[str], base_url: str) -> Optional[str]:
+    """Return the canonicalized rel=canonical URL declared in a page's HTML, if any."""
+    if not html:
+        return None
+    for tag in _LINK_TAG.findall(html):
+        if _REL_CANONICAL.search(tag):
+            href = _HREF.search(tag)
+            if href:
+                target = next(group for group in href.groups() if group is not None).strip()
+                if target:
+                    return canonicalize_url(urljoin(base_url, target))
+    return None
+
+
+def simhash(text: str) -> int:
+    """Compute a 64-bit SimHash fingerprint of a text over word shingles."""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < SHINGLE_SIZE:
+        shingles = Counter([" ".join(words)])
+    else:
+        shingles = Counter(" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1))
+
+    hashes = np.frombuffer(
+        b"".join(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest() for s in shingles),
+        dtype=">u8",
+    )
+    weights = np.fromiter(shingles.values(), dtype=np.int64, count=len(shingles))
+
+    # One row of bits per shingle, most significant bit first
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1).astype(np.int64)
+    votes = (2 * bits - 1).T @ weights
+
+    fingerprint = 0
+    for vote in votes:
+        fingerprint = (fingerprint << 1) | int(vote > 0)
+    return fingerprint
+
+
+class NearDuplicateIndex:
+    """Index of SimHash fingerprints answering "is there a fingerprint within max_distance bits?".
+
+    Fingerprints are split into max_distance + 1 bands. Two fingerprints differing in at most
+    max_distance bits must agree on at least one band, so only fingerprints sharing a band are compared.
+    """
+
+    def __init__(self, max_distance: int = 3):
+        self.max_distance = max_distance
+        n_bands = max_distance + 1
+        band_width = SIMHASH_BITS // n_bands
+        self._bands = [
+            (i * band_width, SIMHASH_BITS if i == n_bands - 1 else (i + 1) * band_width)
+            for i in range(n_bands)
+        ]
+        self._buckets: List[Dict[int, List[int]]] = [{} for _ in self._bands]
+
+    def _band_keys(self, fingerprint: int) -> List[int]:
+        return [(fingerprint >> start) & ((1 << (end - start)) - 1) for start, end in self._bands]
+
+    def add_if_new(self, fingerprint: int) -> bool:
+        """Add a fingerprint unless a near-duplicate is already indexed.
+
+        Returns:
+            True if the fingerprint was added, False if it is a near-duplicate
+        """
+        keys = self._band_keys(fingerprint)
+        for bucket, key in zip(self._buckets, keys):
+            for other in bucket.get(key, ()):
+                if bin(fingerprint ^ other).count("1") <= self.max_distance:
+                    return False
+        for bucket, key in zip(self._buckets, keys):
+            bucket.setdefault(key, []).append(fingerprint)
+        return True
+
+
+def _split_blocks(markdown: str) -> List[str]:
+    return re.split(r"\n\s*\n", markdown)
+
+
+def _block_key(block: str) -> Optional[str]:
+    """Hash of a normalized block, or None for blocks that are never treated as boilerplate."""
+    normalized = " ".join(block.split())
+    # Headers drive chunking, so they are kept even when repeated
+    if not normalized or normalized.startswith("#"):
+        return None
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def find_boilerplate_blocks(markdowns: Iterable[str], min_fraction: float = 0.5, min_pages: int = 3) -> Set[str]:
+    """Find markdown blocks (navigation, footers, banners) repeated across many pages of a crawl.
+
+    Args:
+        markdowns: Markdown of every page in the crawl
+        min_fraction: Fraction of pages a block must appear on to count as boilerplate
+        min_pages: Minimum number of pages a block must appear on to count as boilerplate
+
+    Returns:
+        Keys of the boilerplate blocks, to be passed to strip_boilerplate
+    """
+    counts: Counter = Counter()
+    n_pages = 0
+    for markdown in markdowns:
+        n_pages += 1
+        counts.update({key for key in map(_block_key, _split_blocks(markdown)) if key})
+
+    threshold = max(min_pages, min_fraction * n_pages)
+    return {key for key, count in counts.items() if count >= threshold}
+
+
+def strip_boilerplate(markdown: str, boilerplate: Set[str]) -> str:
+    """Remove boilerplate blocks from a page's markdown."""
+    if not boilerplate:
+        return markdown
+    return "\n\n".join(block for block in _split_blocks(markdown) if _block_key(block) not in boilerplate)
+
+
+def dedupe_pages(
+    store: PageStore,
+    handles: List[PageHandle],
+    max_distance: int = 3,
+    boilerplate_min_fraction: float = 0.5,
+    boilerplate_min_pages: int = 3,
+    boilerplate_sample_pages: int = 200,
+) -> Tuple[List[PageHandle], Set[str], Dict[str, int]]:
+    """Drop duplicate pages from crawl results and find the boilerplate to strip from the rest.
+
+    Exact copies of an earlier page are dropped first. Boilerplate blocks are then detected on the
+    first boilerplate_sample_pages remaining pages, which keeps memory bounded on large crawls since
+    navigation and footers repeat on nearly every page anyway. Finally, each page is fingerprinted
+    with SimHash after its boilerplate is removed, and pages within max_distance bits of an earlier
+    page are dropped. Fingerprinting the stripped text matters on documentation sites, where the
+    shared sidebar and footer would otherwise dominate the shingles of short pages and make
+    unrelated pages look like near-duplicates.
+
+    A page whose canonical URL (rel=canonical when known) matches an earlier page's is only dropped
+    if its content matches too. Some sites declare the same rel=canonical, often their home page,
+    on every page, and those pages must not collapse into one. Such pages are counted as
+    canonical_mismatches and go through the near-duplicate check like any other page.
+
+    Pages are read from the store one at a time; only URLs, hashes and fingerprints are kept in memory.
+
+    Args:
+        store: Page store holding the crawled markdown
+        handles: Handles of the crawled pages
+        max_distance: Maximum Hamming distance between fingerprints of near-duplicate pages
+        boilerplate_min_fraction: See find_boilerplate_blocks
+        boilerplate_min_pages: See find_boilerplate_blocks
+        boilerplate_sample_pages: Number of pages inspected for boilerplate
+
+    Returns:
+        The kept handles, the boilerplate to pass to strip_boilerplate, and counts of what was dropped
+    """
+    def url_key(handle: PageHandle) -> str:
+        return handle.canonical or canonicalize_url(handle.url)
+
+    # URL key of the first page seen with each exact content
+    seen_content: Dict[bytes, str] = {}
+    unique = []
+    duplicate_urls = near_duplicates = canonical_mismatches = 0
+    for handle, markdown in store.iter_pages(handles):
+        # Exact copies are dropped before boilerplate detection, or their shared body would count as boilerplate
+        content_key = hashlib.blake2b(" ".join(markdown.split()).encode("utf-8"), digest_size=16).digest()
+        if content_key in seen_content:
+            if seen_content[content_key] == url_key(handle):
+                duplicate_urls += 1
+            else:
+                near_duplicates += 1
+            continue
+        seen_content[content_key] = url_key(handle)
+        unique.append(handle)
+
+    boilerplate = find_boilerplate_blocks(
+        (markdown for _, markdown in store.iter_pages(unique[:boilerplate_sample_pages])),
+        min_fraction=boilerplate_min_fraction,
+        min_pages=boilerplate_min_pages,
+    )
+
+    index = NearDuplicateIndex(max_distance=max_distance)
+    # Fingerprints of the kept pages under each URL key
+    fingerprints_by_url: Dict[str, List[int]] = {}
+    kept = []
+    for handle, markdown in store.iter_pages(unique):
+        content = strip_boilerplate(markdown, boilerplate)
+        # Pages with nothing left after stripping yield no chunks and are not compared
+        if not content.strip():
+            kept.append(handle)
+            continue
+
+        fingerprint = simhash(content)
+        key = url_key(handle)
+        if key in fingerprints_by_url:
+            if any(bin(fingerprint ^ other).count("1") <= max_distance for other in fingerprints_by_url[key]):
+                duplicate_urls += 1
+                continue
+            canonical_mismatches += 1
+
+        if not index.add_if_new(fingerprint):
+            near_duplicates += 1
+            continue
+        fingerprints_by_url.setdefault(key, []).append(fingerprint)
+        kept.append(handle)
+
+    stats = {
+        "duplicate_urls": duplicate_urls,
+        "near_duplicates": near_duplicates,
+        "canonical_mismatches": canonical_mismatches,
+        "boilerplate_blocks": len(boilerplate),
+    }
+    return kept, boilerplate, stats
@@ -0,0 +1,405 @@
+"""
+index_tools.py
+--------------
+Command-line utility for offline maintenance of ChromaDB collections.
+
+    compact    Rebuild a collection's HNSW index from its stored embeddings, dropping the
+               fragmentation left by re-crawls and deletes, optionally with new index settings.
+    benchmark  Measure recall@k and query latency of candidate HNSW settings on a sample of the
+               collection's own embeddings, to choose settings that meet a latency target.
+    quantize   Build the reduced-precision external vector index of a collection (see vector_index.py).
+    benchmark-storage
+               Measure the memory saved and the recall cost of reduced-precision storage configs.
+
+All commands reuse the stored embeddings, so nothing is re-embedded.
+
+Usage:
+    python -m app.index_tools compact <collection> [--m ...] [--ef-construction ...] [--ef-search ...] [--vacuum]
+    python -m app.index_tools benchmark <collection> [--m 16 32] [--ef-construction 100 200] [--ef-search 10 50 100]
+    python -m app.index_tools quantize <collection> [--dtype int8] [--dims 128] [--reduction pca] [--drop]
+    python -m app.index_tools benchmark-storage <collection> [--dtype float16 int8] [--dims 0 128 64] [--reduction truncate pca]
+"""
+import argparse
+import itertools
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List, Tuple
+
+import chromadb
+import numpy as np
+
+from app.models import VectorStorageConfig
+from app.utils import claim_embedded_chroma, get_chroma_client, get_embedding_function, hnsw_metadata
+from app.vector_index import PCA_SAMPLE_SIZE, VectorIndex, build_vector_index, delete_vector_index, sync_vector_index
+
+HNSW_KEYS = ("hnsw:M", "hnsw:construction_ef", "hnsw:search_ef")
+
+
+def iter_records(collection: chromadb.Collection, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+    """Yield a collection's ids, embeddings, documents and metadatas one batch at a time."""
+    offset = 0
+    while True:
+        batch = collection.get(
+            limit=batch_size,
+            offset=offset,
+            include=["embeddings", "documents", "metadatas"],
+        )
+        if not len(batch["ids"]):
+            return
+        yield batch
+        offset += len(batch["ids"])
+
+
+def compact_collection(
+    client,
+    name: str,
+    embedding_model_name: str,
+    hnsw_config: Dict[str, int],
+    batch_size: int = 1000,
+) -> int:
+    """Rebuild a collection into a fresh index and swap it in under the original name.
+
+    The records are copied with their stored embeddings into a new collection, which replaces the
+    original once the counts match. Index settings not given in hnsw_config are kept. Nothing else
+    may write to the collection while it is rebuilt.
+
+    The swap renames the original to a backup name before renaming the copy, and deletes the backup
+    only once the copy is live, so the records always exist under one of the two names. API requests
+    landing in the short gap between the renames see an empty collection under the original name
+    (get_or_create_collection recreates it); that empty collection is replaced by the copy.
+
+    Returns:
+        Number of records in the rebuilt collection
+    """
+    source = client.get_collection(name=name)
+    metadata = dict(source.metadata or {})
+    metadata.update(hnsw_config)
+    metadata.setdefault("hnsw:space", "cosine")
+
+    rebuild_name = f"{name}-rebuild"
+    try:
+        client.delete_collection(name=rebuild_name)  # Left over from an interrupted run
+    except Exception:
+        pass
+    target = client.create_collection(
+        name=rebuild_name,
+        metadata=metadata,
+        embedding_function=get_embedding_function(embedding_model_name),
+    )
+
+    for batch in iter_records(source, batch_size=batch_size):
+        target.add(
+            ids=batch["ids"],
+            embeddings=batch["embeddings"],
+            documents=batch["documents"],
+            metadatas=batch["metadatas"],
+        )
+        print(f"Copied {target.count()}/{source.count()} records")
+
+    if target.count() != source.count():
+        raise RuntimeError(f"Rebuild of '{name}' is incomplete, original left untouched and copy kept as '{rebuild_name}'")
+
+    backup_name = f"{name}-backup"
+    try:
+        client.delete_collection(name=backup_name)  # Left over from an interrupted run
+    except Exception:
+        pass
+    source.modify(name=backup_name)
+    try:
+        target.modify(name=name)
+    except Exception:
+        # A request recreated the name during the swap. Replace it if it is still empty.
+        placeholder = client.get_collection(name=name)
+        if placeholder.count():
+            raise RuntimeError(
+                f"'{name}' was written to during the swap. Original kept as '{backup_name}' and copy as '{rebuild_name}'"
+            )
+        client.delete_collection(name=name)
+        target.modify(name=name)
+    client.delete_collection(name=backup_name)
+    return target.count()
+
+
+def sample_embeddings(collection: chromadb.Collection, sample_size: int, batch_size: int = 1000) -> np.ndarray:
+    """Read up to sample_size stored embeddings from a collection."""
+    vectors = []
+    offset = 0
+    while offset < sample_size:
+        batch = collection.get(limit=min(batch_size, sample_size - offset), offset=offset, include=["embeddings"])
+        if not len(batch["ids"]):
+            break
+        vectors.append(np.asarray(batch["embeddings"], dtype=np.float32))
+        offset += len(batch["ids"])
+    return np.concatenate(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
+
+
+def exact_neighbours(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """Ground-truth top-k indices by brute-force cosine similarity."""
+    corpus_norm = corpus / np.linalg.norm(corpus, axis=1, keepdims=True)
+    query_norm = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    similarities = query_norm @ corpus_norm.T
+    return np.argsort(-similarities, axis=1)[:, :k]
+
+
+def holdout_split(
+    collection: chromadb.Collection,
+    sample_size: int,
+    n_queries: int,
+    k: int,
+    seed: int = 0,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Sample stored embeddings and hold some out as queries.
+
+    Returns:
+        Corpus vectors, query vectors, and the exact top-k corpus indices of each query
+    """
+    sample = sample_embeddings(collection, sample_size)
+    n_queries = min(n_queries, len(sample) // 2)
+    if len(sample) - n_queries <= k or n_queries == 0:
+        raise ValueError(f"Collection '{collection.name}' has too few records to benchmark with k={k}")
+
+    rng = np.random.default_rng(seed)
+    held_out = np.zeros(len(sample), dtype=bool)
+    held_out[rng.choice(len(sample), size=n_queries, replace=False)] = True
+    queries, corpus = sample[held_out], sample[~held_out]
+    return corpus, queries, exact_neighbours(corpus, queries, k)
+
+
+def benchmark_settings(
+    corpus: np.ndarray,
+    queries: np.ndarray,
+    truth: np.ndarray,
+    hnsw_config: Dict[str, int],
+    k: int,
+) -> Tuple[float, float, float, float]:
+    """Build an in-memory index with the given settings and measure it.
+
+    Returns:
+        Recall@k, p50 and p99 query latency in milliseconds, and build time in seconds
+    """
+    client = chromadb.EphemeralClient()
+    name = "benchmark-" + "-".join(str(v) for v in hnsw_config.values())
+    collection = client.create_collection(name=name, metadata={"hnsw:space": "cosine", **hnsw_config})
+
+    start = time.perf_counter()
+    ids = [str(i) for i in range(len(corpus))]
+    for i in range(0, len(corpus), 1000):
+        collection.add(ids=ids[i:i + 1000], embeddings=corpus[i:i + 1000].tolist())
+    build_seconds = time.perf_counter() - start
+
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        result = collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(set(int(i) for i in result["ids"][0]) & set(expected.tolist()))
+
+    client.delete_collection(name=name)
+    recall = hits / (len(queries) * k)
+    return recall, float(np.percentile(latencies, 50)), float(np.percentile(latencies, 99)), build_seconds
+
+
+def run_benchmark(
+    collection: chromadb.Collection,
+    m_values: List[int],
+    ef_construction_values: List[int],
+    ef_search_values: List[int],
+    sample_size: int,
+    n_queries: int,
+    k: int,
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    """Benchmark every combination of HNSW settings on a sample of the collection's embeddings.
+
+    Queries are stored embeddings held out from the sample, with ground truth from an exact search
+    over the rest of the sample.
+    """
+    corpus, queries, truth = holdout_split(collection, sample_size, n_queries, k, seed)
+
+    rows = []
+    for m, ef_construction, ef_search in itertools.product(m_values, ef_construction_values, ef_search_values):
+        config = hnsw_metadata(m=m, ef_construction=ef_construction, ef_search=ef_search)
+        recall, p50, p99, build_seconds = benchmark_settings(corpus, queries, truth, config, k)
+        rows.append({
+            "m": m,
+            "ef_construction": ef_construction,
+            "ef_search": ef_search,
+            "recall": recall,
+            "p50_ms": p50,
+            "p99_ms": p99,
+            "build_s": build_seconds,
+        })
+        print(f"M={m:<4} ef_construction={ef_construction:<5} ef_search={ef_search:<5} "
+              f"recall@{k}={recall:.3f}  p50={p50:.2f}ms  p99={p99:.2f}ms  build={build_seconds:.1f}s")
+    return rows
+
+
+def run_storage_benchmark(
+    collection: chromadb.Collection,
+    configs: List[VectorStorageConfig],
+    sample_size: int,
+    n_queries: int,
+    k: int,
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    """Benchmark reduced-precision storage configs on a sample of the collection's embeddings.
+
+    Each config is built into a temporary external index. Recall@k of the re-scored results is
+    measured against an exact float32 search, along with the in-memory size of the compact vectors.
+    """
+    corpus, queries, truth = holdout_split(collection, sample_size, n_queries, k, seed)
+    ids = [str(i) for i in range(len(corpus))]
+
+    rows = []
+    for config in configs:
+        with tempfile.TemporaryDirectory() as directory:
+            index = VectorIndex.build(
+                os.path.join(directory, "index"),
+                [(ids, corpus)],
+                len(corpus),
+                corpus.shape[1],
+                config,
+                "",
+                corpus[:PCA_SAMPLE_SIZE],
+            )
+            start = time.perf_counter()
+            found, _ = index.search(queries, k)
+            query_ms = (time.perf_counter() - start) * 1000 / len(queries)
+            recall = sum(len(set(f.tolist()) & set(t.tolist())) for f, t in zip(found, truth)) / (len(queries) * k)
+            saved = 1 - index.memory_bytes / index.full_precision_bytes
+            rows.append({**config.model_dump(), "recall": recall, "memory_saved": saved, "query_ms": query_ms})
+            del index
+        print(f"dtype={config.dtype:<8} dims={config.dims or corpus.shape[1]:<5} reduction={config.reduction:<9} "
+              f"oversample={config.oversample:<3} recall@{k}={recall:.3f}  memory saved={saved:.0%}  query={query_ms:.2f}ms")
+    return rows
+
+
+def vacuum(db_dir: str) -> None:
+    """Reclaim space left in the embedded ChromaDB SQLite file after a rebuild."""
+    path = os.path.join(db_dir, "chroma.sqlite3")
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline maintenance of ChromaDB collections")
+    parser.add_argument("--db-dir", default="./chroma_db", help="ChromaDB directory")
+    parser.add_argument("--chroma-host", default=None, help="ChromaDB server host (uses the embedded database in --db-dir if omitted)")
+    parser.add_argument("--chroma-port", type=int, default=8000, help="ChromaDB server port")
+    parser.add_argument("--embedding-model", default="all-MiniLM-L6-v2", help="Embedding model name")
+    parser.add_argument("--force", action="store_true", help="Run even if another process holds the embedded ChromaDB lock")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compact = commands.add_parser("compact", help="Rebuild a collection's index from its stored embeddings")
+    compact.add_argument("collection", help="ChromaDB collection name")
+    compact.add_argument("--m", type=int, default=None, help="New hnsw:M (kept if omitted)")
+    compact.add_argument("--ef-construction", type=int, default=None, help="New hnsw:construction_ef (kept if omitted)")
+    compact.add_argument("--ef-search", type=int, default=None, help="New hnsw:search_ef (kept if omitted)")
+    compact.add_argument("--batch-size", type=int, default=1000, help="Records copied per batch")
+    compact.add_argument("--vacuum", action="store_true", help="VACUUM the embedded SQLite file afterwards")
+
+    benchmark = commands.add_parser("benchmark", help="Measure recall and latency of HNSW settings on the collection's data")
+    benchmark.add_argument("collection", help="ChromaDB collection name")
+    benchmark.add_argument("--m", type=int, nargs="+", default=[16], help="hnsw:M values to try")
+    benchmark.add_argument("--ef-construction", type=int, nargs="+", default=[100], help="hnsw:construction_ef values to try")
+    benchmark.add_argument("--ef-search", type=int, nargs="+", default=[10, 50, 100], help="hnsw:search_ef values to try")
+    benchmark.add_argument("--sample-size", type=int, default=20000, help="Number of stored embeddings to index")
+    benchmark.add_argument("--queries", type=int, default=200, help="Number of queries to run per setting")
+    benchmark.add_argument("--k", type=int, default=5, help="Number of results per query")
+    benchmark.add_argument("--p99-target-ms", type=float, default=None, help="Report the best recall within this p99 latency")
+    quantize = commands.add_parser("quantize", help="Build a reduced-precision external vector index for a collection")
+    quantize.add_argument("collection", help="ChromaDB collection name")
+    quantize.add_argument("--dtype", choices=["float32", "float16", "int8"], default="float16", help="Precision of the compact vectors")
+    quantize.add_argument("--dims", type=int, default=None, help="Dimensions kept (all if omitted)")
+    quantize.add_argument("--reduction", choices=["truncate", "pca"], default="truncate", help="How dimensions are reduced")
+    quantize.add_argument("--oversample", type=int, default=4, help="Candidates re-scored in full precision per result")
+    quantize.add_argument("--drop", action="store_true", help="Remove the collection's external index instead")
+
+    storage = commands.add_parser("benchmark-storage", help="Measure memory saved and recall of reduced-precision storage")
+    storage.add_argument("collection", help="ChromaDB collection name")
+    storage.add_argument("--dtype", nargs="+", choices=["float32", "float16", "int8"], default=["float16", "int8"], help="Precisions to try")
+    storage.add_argument("--dims", type=int, nargs="+", default=[0], help="Dimensions to keep (0 keeps all)")
+    storage.add_argument("--reduction", nargs="+", choices=["truncate", "pca"], default=["truncate"], help="Reductions to try")
+    storage.add_argument("--oversample", type=int, nargs="+", default=[4], help="Oversample factors to try")
+    storage.add_argument("--sample-size", type=int, default=20000, help="Number of stored embeddings to index")
+    storage.add_argument("--queries", type=int, default=200, help="Number of queries to run per config")
+    storage.add_argument("--k", type=int, default=5, help="Number of results per query")
+    args = parser.parse_args()
+
+    # An embedded ChromaDB must not be opened by two processes, and compaction in particular must not race the API
+    if not args.chroma_host and not claim_embedded_chroma(args.db_dir) and not args.force:
+        print(f"Another process (such as the API) is using the embedded ChromaDB in {args.db_dir}. "
+              "Stop it first, or run against a ChromaDB server with --chroma-host.")
+        sys.exit(1)
+    client = get_chroma_client(args.db_dir, host=args.chroma_host, port=args.chroma_port)
+
+    if args.command == "compact":
+        config = hnsw_metadata(m=args.m, ef_construction=args.ef_construction, ef_search=args.ef_search)
+        count = compact_collection(client, args.collection, args.embedding_model, config, batch_size=args.batch_size)
+        print(f"Rebuilt collection '{args.collection}' with {count} records.")
+        # The rebuilt collection has a new id, so its external index (if any) is rebuilt too
+        if sync_vector_index(client.get_collection(name=args.collection), args.db_dir, args.embedding_model):
+            print(f"Rebuilt the external vector index of '{args.collection}'.")
+        if args.vacuum:
+            if args.chroma_host:
+                print("--vacuum only applies to the embedded database, skipped.")
+            else:
+                vacuum(args.db_dir)
+                print("Vacuumed the ChromaDB database file.")
+        return
+
+    if args.command == "quantize":
+        if args.drop:
+            delete_vector_index(args.db_dir, args.collection)
+            print(f"Removed the external vector index of '{args.collection}'.")
+            return
+        config = VectorStorageConfig(dtype=args.dtype, dims=args.dims, reduction=args.reduction, oversample=args.oversample)
+        index = build_vector_index(client.get_collection(name=args.collection), args.db_dir, config, args.embedding_model)
+        if index is None:
+            print(f"Collection '{args.collection}' is empty, nothing to index.")
+            sys.exit(1)
+        print(f"Built external index of '{args.collection}' with {len(index.ids)} vectors: "
+              f"{index.memory_bytes / 2**20:.1f} MiB in memory instead of {index.full_precision_bytes / 2**20:.1f} MiB.")
+        return
+
+    if args.command == "benchmark-storage":
+        configs = [
+            VectorStorageConfig(dtype=dtype, dims=dims or None, reduction=reduction, oversample=oversample)
+            for dtype, dims, reduction, oversample in itertools.product(args.dtype, args.dims, args.reduction, args.oversample)
+        ]
+        run_storage_benchmark(client.get_collection(name=args.collection), configs, args.sample_size, args.queries, args.k)
+        return
+
+    collection = client.get_collection(name=args.collection)
+    current = {key: value for key, value in (collection.metadata or {}).items() if key in HNSW_KEYS}
+    print(f"Collection '{args.collection}': {collection.count()} records, current settings {current or 'ChromaDB defaults'}")
+
+    rows = run_benchmark(
+        collection,
+        args.m,
+        args.ef_construction,
+        args.ef_search,
+        sample_size=args.sample_size,
+        n_queries=args.queries,
+        k=args.k,
+    )
+
+    if args.p99_target_ms is not None:
+        within = [row for row in rows if row["p99_ms"] <= args.p99_target_ms]
+        if not within:
+            print(f"No setting met p99 <= {args.p99_target_ms}ms.")
+            sys.exit(1)
+        best = max(within, key=lambda row: (row["recall"], -row["p99_ms"]))
+        print(f"Best within p99 <= {args.p99_target_ms}ms: M={best['m']} ef_construction={best['ef_construction']} "
+              f"ef_search={best['ef_search']} (recall@{args.k}={best['recall']:.3f}, p99={best['p99_ms']:.2f}ms)")
+
+
+if __name__ == "__main__":
+    main()
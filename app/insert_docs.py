@@ -6,18 +6,35 @@ use the appropriate crawl method, chunk the resulting Markdown into <1000 charac
 and insert all chunks into ChromaDB with metadata.
 
 Usage:
-    python insert_docs.py <URL> [--collection ...] [--db-dir ...] [--embedding-model ...]
+    python insert_docs.py <URL> [--collection ...] [--db-dir ...] [--chroma-host ...] [--embedding-model ...]
 """
 import argparse
 import sys
 import re
 import asyncio
-from typing import List, Dict, Any
-from urllib.parse import urlparse, urldefrag
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, AsyncIterator, Callable, Iterable, Optional, Set
+from urllib.parse import urldefrag, urlparse
 from xml.etree import ElementTree
-from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode, MemoryAdaptiveDispatcher
+from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode
 import requests
-from app.utils import get_chroma_client, get_or_create_collection, add_documents_to_collection
+from app.utils import get_chroma_client, get_or_create_collection, add_documents_to_collection, claim_embedded_chroma
+from app.dedup import canonicalize_url, extract_canonical_url, dedupe_pages, strip_boilerplate
+from app.page_store import PageHandle, PageStore
+from app.scheduler import CrawlBudget, local_budget
+from app.vector_index import sync_vector_index
+
+# Progress callback receiving one event dict per fetched or indexed page
+ProgressCallback = Callable[[Dict[str, Any]], None]
+
+def _report_fetch(on_page: Optional[ProgressCallback], result, depth: int) -> None:
+    if on_page is None:
+        return
+    ok = bool(result.success and result.markdown)
+    event = {"url": result.url, "status": "ok" if ok else "failed", "status_code": getattr(result, "status_code", None), "depth": depth}
+    if not ok:
+        event["error"] = result.error_message or "no content"
+    on_page(event)
 
 def smart_chunk_markdown(markdown: str, max_len: int = 1000) -> List[str]:
     """Hierarchically splits markdown by #, ##, ### headers, then by characters, to ensure all chunks < max_len."""
@@ -59,57 +76,118 @@ def is_sitemap(url: str) -> bool:
 def is_txt(url: str) -> bool:
     return url.endswith('.txt')
 
-async def crawl_recursive_internal_links(start_urls, max_depth=3, max_concurrent=10) -> List[Dict[str,Any]]:
-    """Recursive crawl using logic from 5-crawl_recursive_internal_links.py. Returns list of dicts with url and markdown."""
+@asynccontextmanager
+async def _crawler_session(crawler: Optional[AsyncWebCrawler], browser_config: BrowserConfig) -> AsyncIterator[AsyncWebCrawler]:
+    """Use the given crawler, or open one for the duration of the block if none is given."""
+    if crawler is not None:
+        yield crawler
+    else:
+        async with AsyncWebCrawler(config=browser_config) as own_crawler:
+            yield own_crawler
+
+async def fetch_pages(crawler: AsyncWebCrawler, urls: Iterable[str], config: CrawlerRunConfig, budget: CrawlBudget) -> AsyncIterator[Any]:
+    """Fetch URLs through the crawl budget and yield results as they complete.
+
+    At most budget.max_concurrent workers pull URLs from the iterable, and each fetch holds a
+    budget slot, so several crawls sharing a budget share its concurrency limit.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=budget.max_concurrent)
+    url_iter = iter(urls)
+
+    async def worker():
+        for url in url_iter:
+            try:
+                async with budget.slot():
+                    result = await crawler.arun(url=url, config=config)
+            except Exception as e:
+                print(f"Error crawling {url}: {e}")
+                continue
+            await queue.put(result)
+
+    async def run_workers():
+        await asyncio.gather(*(worker() for _ in range(budget.max_concurrent)))
+        await queue.put(None)
+
+    runner = asyncio.create_task(run_workers())
+    try:
+        while (result := await queue.get()) is not None:
+            yield result
+    finally:
+        runner.cancel()
+
+async def crawl_recursive_internal_links(
+    start_urls,
+    store: PageStore,
+    max_depth=3,
+    max_concurrent=10,
+    budget: Optional[CrawlBudget] = None,
+    crawler: Optional[AsyncWebCrawler] = None,
+    on_page: Optional[ProgressCallback] = None,
+) -> List[PageHandle]:
+    """Recursive crawl using logic from 5-crawl_recursive_internal_links.py.
+
+    Results are streamed from the crawler and each page's markdown is written to the page store as soon
+    as it arrives, so memory use does not grow with the size of the site. Returns handles to the stored pages.
+    Pages are fetched through the given crawl budget, or a budget of max_concurrent slots if none is given.
+    """
     browser_config = BrowserConfig(headless=True, verbose=False)
-    run_config = CrawlerRunConfig(cache_mode=CacheMode.BYPASS, stream=False)
-    dispatcher = MemoryAdaptiveDispatcher(
-        memory_threshold_percent=70.0,
-        check_interval=1.0,
-        max_session_permit=max_concurrent
-    )
+    run_config = CrawlerRunConfig(cache_mode=CacheMode.BYPASS)
+    budget = budget or local_budget(max_concurrent)
 
+    # Canonical URLs are only used to track visited pages. Pages are fetched at their original URL, since
+    # some of the parameters canonicalization drops (such as ref) select content on some sites.
     visited = set()
 
-    def normalize_url(url):
-        return urldefrag(url)[0]
-
-    current_urls = set([normalize_url(u) for u in start_urls])
-    results_all = []
+    current_urls = {canonicalize_url(u): urldefrag(u)[0] for u in start_urls}
+    handles = []
 
-    async with AsyncWebCrawler(config=browser_config) as crawler:
+    async with _crawler_session(crawler, browser_config) as crawler:
         for depth in range(max_depth):
-            urls_to_crawl = [normalize_url(url) for url in current_urls if normalize_url(url) not in visited]
+            urls_to_crawl = [url for key, url in current_urls.items() if key not in visited]
             if not urls_to_crawl:
                 break
+            visited.update(current_urls)
 
-            results = await crawler.arun_many(urls=urls_to_crawl, config=run_config, dispatcher=dispatcher)
-            next_level_urls = set()
+            next_level_urls = {}
 
-            for result in results:
-                norm_url = normalize_url(result.url)
+            async for result in fetch_pages(crawler, urls_to_crawl, run_config, budget):
+                norm_url = canonicalize_url(result.url)
                 visited.add(norm_url)
+                _report_fetch(on_page, result, depth)
 
                 if result.success and result.markdown:
-                    results_all.append({'url': result.url, 'markdown': result.markdown})
+                    # A page declaring another canonical URL also marks that URL as visited
+                    canonical = extract_canonical_url(result.html, result.url)
+                    if canonical:
+                        visited.add(canonical)
+                    handles.append(store.append(result.url, result.markdown, canonical=canonical, depth=depth))
                     for link in result.links.get("internal", []):
-                        next_url = normalize_url(link["href"])
-                        if next_url not in visited:
-                            next_level_urls.add(next_url)
+                        next_key = canonicalize_url(link["href"])
+                        if next_key not in visited:
+                            next_level_urls.setdefault(next_key, urldefrag(link["href"])[0])
 
             current_urls = next_level_urls
 
-    return results_all
+    return handles
 
-async def crawl_markdown_file(url: str) -> List[Dict[str,Any]]:
+async def crawl_markdown_file(
+    url: str,
+    store: PageStore,
+    budget: Optional[CrawlBudget] = None,
+    crawler: Optional[AsyncWebCrawler] = None,
+    on_page: Optional[ProgressCallback] = None,
+) -> List[PageHandle]:
     """Crawl a .txt or markdown file using logic from 4-crawl_and_chunk_markdown.py."""
     browser_config = BrowserConfig(headless=True)
     crawl_config = CrawlerRunConfig()
+    budget = budget or local_budget(1)
 
-    async with AsyncWebCrawler(config=browser_config) as crawler:
-        result = await crawler.arun(url=url, config=crawl_config)
+    async with _crawler_session(crawler, browser_config) as crawler:
+        async with budget.slot():
+            result = await crawler.arun(url=url, config=crawl_config)
+        _report_fetch(on_page, result, 0)
         if result.success and result.markdown:
-            return [{'url': url, 'markdown': result.markdown}]
+            return [store.append(url, result.markdown)]
         else:
             print(f"Failed to crawl {url}: {result.error_message}")
             return []
@@ -127,19 +205,59 @@ def parse_sitemap(sitemap_url: str) -> List[str]:
 
     return urls
 
-async def crawl_batch(urls: List[str], max_concurrent: int = 10) -> List[Dict[str,Any]]:
-    """Batch crawl using logic from 3-crawl_sitemap_in_parallel.py."""
+async def crawl_batch(
+    urls: List[str],
+    store: PageStore,
+    max_concurrent: int = 10,
+    budget: Optional[CrawlBudget] = None,
+    crawler: Optional[AsyncWebCrawler] = None,
+    on_page: Optional[ProgressCallback] = None,
+) -> List[PageHandle]:
+    """Batch crawl using logic from 3-crawl_sitemap_in_parallel.py. Pages are streamed into the page store."""
     browser_config = BrowserConfig(headless=True, verbose=False)
-    crawl_config = CrawlerRunConfig(cache_mode=CacheMode.BYPASS, stream=False)
-    dispatcher = MemoryAdaptiveDispatcher(
-        memory_threshold_percent=70.0,
-        check_interval=1.0,
-        max_session_permit=max_concurrent
-    )
-
-    async with AsyncWebCrawler(config=browser_config) as crawler:
-        results = await crawler.arun_many(urls=urls, config=crawl_config, dispatcher=dispatcher)
-        return [{'url': r.url, 'markdown': r.markdown} for r in results if r.success and r.markdown]
+    crawl_config = CrawlerRunConfig(cache_mode=CacheMode.BYPASS)
+    budget = budget or local_budget(max_concurrent)
+
+    # Sitemaps often list the same page under several URL variants. Keep the first <loc> of each
+    # canonical URL, and fetch it as listed.
+    first_locs = {}
+    for u in urls:
+        first_locs.setdefault(canonicalize_url(u), u)
+    urls = list(first_locs.values())
+    handles = []
+
+    async with _crawler_session(crawler, browser_config) as crawler:
+        async for r in fetch_pages(crawler, urls, crawl_config, budget):
+            _report_fetch(on_page, r, 0)
+            if r.success and r.markdown:
+                handles.append(store.append(r.url, r.markdown, canonical=extract_canonical_url(r.html, r.url)))
+        return handles
+
+async def crawl_url(
+    url: str,
+    store: PageStore,
+    budget: CrawlBudget,
+    crawler: Optional[AsyncWebCrawler] = None,
+    max_depth: int = 3,
+    on_page: Optional[ProgressCallback] = None,
+) -> List[PageHandle]:
+    """Detect the type of a seed URL and crawl it with the matching strategy. Errors are logged and yield no pages."""
+    try:
+        if is_txt(url):
+            return await crawl_markdown_file(url, store, budget=budget, crawler=crawler, on_page=on_page)
+
+        if is_sitemap(url):
+            # Parse the XML to extract all page URLs then crawl all of them in parallel
+            sitemap_urls = await asyncio.to_thread(parse_sitemap, url)
+            if not sitemap_urls: # Don't fail if the sitemap is empty, there is just nothing to crawl
+                return []
+            return await crawl_batch(sitemap_urls, store, budget=budget, crawler=crawler, on_page=on_page)
+
+        return await crawl_recursive_internal_links([url], store, max_depth=max_depth, budget=budget, crawler=crawler, on_page=on_page)
+
+    except Exception as e:
+        print(f"Error crawling {url}: {e}")
+        return []
 
 def extract_section_info(chunk: str) -> Dict[str, Any]:
     """Extracts headers and stats from a chunk."""
@@ -152,61 +270,111 @@ def extract_section_info(chunk: str) -> Dict[str, Any]:
         "word_count": len(chunk.split())
     }
 
+def _report_indexed(on_page: Optional[ProgressCallback], pages) -> None:
+    if on_page is None:
+        return
+    for handle, n_chunks in pages:
+        on_page({"url": handle.url, "depth": handle.depth, "chunks": n_chunks})
+
+def index_pages(
+    store: PageStore,
+    handles: List[PageHandle],
+    collection,
+    chunk_size: int = 1000,
+    boilerplate: Optional[Set[str]] = None,
+    batch_size: int = 100,
+    on_page: Optional[ProgressCallback] = None,
+) -> int:
+    """Chunk stored pages and insert the chunks into a collection one batch at a time.
+
+    Pages are read from the store one by one and chunks are flushed to ChromaDB every batch_size
+    chunks, so memory use stays flat however many pages were crawled. Returns the number of chunks inserted.
+    on_page is called for each page once its chunks are inserted.
+    """
+    pending_pages = []  # Pages whose chunks are in the current, not yet inserted batch
+    ids, documents, metadatas = [], [], []
+    chunk_idx = 0  # Global counter across all documents for unique IDs
+
+    for handle, markdown in store.iter_pages(handles):
+        if boilerplate:
+            markdown = strip_boilerplate(markdown, boilerplate)
+
+        page_chunks = smart_chunk_markdown(markdown, max_len=chunk_size)
+        pending_pages.append((handle, len(page_chunks)))
+        for chunk in page_chunks:
+            ids.append(f"chunk-{chunk_idx}")
+            documents.append(chunk)
+            meta = extract_section_info(chunk)
+            meta["chunk_index"] = chunk_idx
+            meta["source"] = handle.url  # Track which URL this came from
+            metadatas.append(meta)
+            chunk_idx += 1
+
+        if len(documents) >= batch_size:
+            add_documents_to_collection(collection, ids, documents, metadatas, batch_size=batch_size)
+            ids, documents, metadatas = [], [], []
+            _report_indexed(on_page, pending_pages)
+            pending_pages = []
+
+    if documents:
+        add_documents_to_collection(collection, ids, documents, metadatas, batch_size=batch_size)
+    _report_indexed(on_page, pending_pages)
+
+    return chunk_idx
+
 def main():
     parser = argparse.ArgumentParser(description="Insert crawled docs into ChromaDB")
     parser.add_argument("url", help="URL to crawl (regular, .txt, or sitemap)")
     parser.add_argument("--collection", default="docs", help="ChromaDB collection name")
     parser.add_argument("--db-dir", default="./chroma_db", help="ChromaDB directory")
+    parser.add_argument("--chroma-host", default=None, help="ChromaDB server host (uses the embedded database in --db-dir if omitted)")
+    parser.add_argument("--chroma-port", type=int, default=8000, help="ChromaDB server port")
     parser.add_argument("--embedding-model", default="all-MiniLM-L6-v2", help="Embedding model name")
     parser.add_argument("--chunk-size", type=int, default=1000, help="Max chunk size (chars)")
     parser.add_argument("--max-depth", type=int, default=3, help="Recursion depth for regular URLs")
     parser.add_argument("--max-concurrent", type=int, default=10, help="Max parallel browser sessions")
     parser.add_argument("--batch-size", type=int, default=100, help="ChromaDB insert batch size")
+    parser.add_argument("--no-dedup", action="store_true", help="Keep duplicate pages and boilerplate blocks")
+    parser.add_argument("--page-store-dir", default=None, help="Directory for the temporary crawled page store (system temp dir if omitted)")
     args = parser.parse_args()
 
-    # Detect URL type
-    url = args.url
-    if is_txt(url):
-        print(f"Detected .txt/markdown file: {url}")
-        crawl_results = asyncio.run(crawl_markdown_file(url))
-    elif is_sitemap(url):
-        print(f"Detected sitemap: {url}")
-        sitemap_urls = parse_sitemap(url)
-        if not sitemap_urls:
-            print("No URLs found in sitemap.")
-            sys.exit(1)
-        crawl_results = asyncio.run(crawl_batch(sitemap_urls, max_concurrent=args.max_concurrent))
-    else:
-        print(f"Detected regular URL: {url}")
-        crawl_results = asyncio.run(crawl_recursive_internal_links([url], max_depth=args.max_depth, max_concurrent=args.max_concurrent))
+    with PageStore(args.page_store_dir) as store:
+        # Detect URL type
+        url = args.url
+        if is_txt(url):
+            print(f"Detected .txt/markdown file: {url}")
+            handles = asyncio.run(crawl_markdown_file(url, store))
+        elif is_sitemap(url):
+            print(f"Detected sitemap: {url}")
+            sitemap_urls = parse_sitemap(url)
+            if not sitemap_urls:
+                print("No URLs found in sitemap.")
+                sys.exit(1)
+            handles = asyncio.run(crawl_batch(sitemap_urls, store, max_concurrent=args.max_concurrent))
+        else:
+            print(f"Detected regular URL: {url}")
+            handles = asyncio.run(crawl_recursive_internal_links([url], store, max_depth=args.max_depth, max_concurrent=args.max_concurrent))
 
-    # Chunk and collect metadata
-    ids, documents, metadatas = [], [], []
-    chunk_idx = 0
-    for doc in crawl_results:
-        url = doc['url']
-        md = doc['markdown']
-        chunks = smart_chunk_markdown(md, max_len=args.chunk_size)
-        for chunk in chunks:
-            ids.append(f"chunk-{chunk_idx}")
-            documents.append(chunk)
-            meta = extract_section_info(chunk)
-            meta["chunk_index"] = chunk_idx
-            meta["source"] = url
-            metadatas.append(meta)
-            chunk_idx += 1
+        boilerplate = set()
+        if not args.no_dedup:
+            handles, boilerplate, dedup_stats = dedupe_pages(store, handles)
+            print(f"Deduplication: {dedup_stats}")
 
-    if not documents:
-        print("No documents found to insert.")
-        sys.exit(1)
+        print(f"Chunking {len(handles)} pages into ChromaDB collection '{args.collection}'...")
 
-    print(f"Inserting {len(documents)} chunks into ChromaDB collection '{args.collection}'...")
+        if not args.chroma_host and not claim_embedded_chroma(args.db_dir):
+            print(f"Warning: another process (such as the API) already uses the embedded ChromaDB in {args.db_dir}. Use --chroma-host with a ChromaDB server instead.")
+        client = get_chroma_client(args.db_dir, host=args.chroma_host, port=args.chroma_port)
+        collection = get_or_create_collection(client, args.collection, embedding_model_name=args.embedding_model)
+        inserted = index_pages(store, handles, collection, chunk_size=args.chunk_size, boilerplate=boilerplate, batch_size=args.batch_size)
+        # Bring the reduced-precision index up to date if the collection uses one
+        sync_vector_index(collection, args.db_dir, args.embedding_model)
 
-    client = get_chroma_client(args.db_dir)
-    collection = get_or_create_collection(client, args.collection, embedding_model_name=args.embedding_model)
-    add_documents_to_collection(collection, ids, documents, metadatas, batch_size=args.batch_size)
+    if not inserted:
+        print("No documents found to insert.")
+        sys.exit(1)
 
-    print(f"Successfully added {len(documents)} chunks to ChromaDB collection '{args.collection}'.")
+    print(f"Successfully added {inserted} chunks to ChromaDB collection '{args.collection}'.")
 
 if __name__ == "__main__":
     main()
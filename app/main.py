@@ -1,32 +1,65 @@
+import importlib
 import time
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from app.config import settings
 from app.logging_config import logger
-from crawl4ai.utils import configure_windows_event_loop
-from app.routes import auth_routes
-from app.routes import collections
-from app.routes import crawl
-from app.routes import chat
 
-# crawl4ai function that configures windows to use ProactorEventLoop which is required for async subprocesses used in 
-# crawling. This should be called at the very start of the program before any async code runs. Otherwise it will use 
-# SelectorEventLoop which does not support subprocesses and will cause the crawler to fail on Window.
-configure_windows_event_loop()
+# Routers served by each deployment role. Router modules are imported only for the active role, so a
+# chat-only replica never imports crawl4ai and a crawl-only replica never imports openai.
+ROLE_ROUTERS = {
+    "all": ["auth_routes", "collections", "crawl", "chat", "search"],
+    "crawl": ["auth_routes", "collections", "crawl"],
+    "chat": ["auth_routes", "collections", "chat", "search"],
+}
 
-app = FastAPI()
+if settings.APP_ROLE not in ROLE_ROUTERS:
+    raise ValueError(f"Unknown APP_ROLE '{settings.APP_ROLE}', expected one of {sorted(ROLE_ROUTERS)}")
 
-app.include_router(auth_routes.router)
-logger.info("auth_routes loaded.")
+router_names = ROLE_ROUTERS[settings.APP_ROLE]
+serves_crawl = "crawl" in router_names
+serves_chat = "chat" in router_names
 
-app.include_router(collections.router)
-logger.info("collections loaded.")
+if serves_crawl:
+    # Importing crawl4ai is the largest import cost of the crawl role and happens before the routers are
+    # loaded below, so it is timed separately
+    start = time.perf_counter()
+    from crawl4ai.utils import configure_windows_event_loop
+    logger.info(f"crawl4ai imported in {time.perf_counter() - start:.2f}s.")
 
-app.include_router(crawl.router)
-logger.info(f"crawl loaded.")
+    # crawl4ai function that configures windows to use ProactorEventLoop which is required for async subprocesses used in
+    # crawling. This should be called at the very start of the program before any async code runs. Otherwise it will use
+    # SelectorEventLoop which does not support subprocesses and will cause the crawler to fail on Window.
+    configure_windows_event_loop()
 
-app.include_router(chat.router)
-logger.info(f"chat loaded.")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm-up runs in each worker after the fork, never in a pre-fork parent
+    from app.warmup import run_warmup
+    from app.utils import claim_embedded_chroma
+
+    # An embedded ChromaDB is a single-process database. With several workers each process would open
+    # its own instance on top of the same directory, so multi-worker deployments must use a ChromaDB server.
+    if not settings.CHROMA_HOST and not claim_embedded_chroma(settings.CHROMA_DB_DIR):
+        logger.warning(
+            "Another process already uses the embedded ChromaDB in %s, which is not supported. "
+            "Set CHROMA_HOST to use a ChromaDB server (see docs/Deployment.md).", settings.CHROMA_DB_DIR
+        )
+
+    start = time.perf_counter()
+    await run_warmup(serves_crawl=serves_crawl, serves_chat=serves_chat)
+    logger.info(f"Warm-up finished in {time.perf_counter() - start:.2f}s")
+    yield
+
+app = FastAPI(lifespan=lifespan)
+
+for name in router_names:
+    start = time.perf_counter()
+    module = importlib.import_module(f"app.routes.{name}")
+    app.include_router(module.router)
+    logger.info(f"{name} loaded in {time.perf_counter() - start:.2f}s.")
 
 @app.get("/")
 async def root():
     logger.info("Root endpoint hit")
-    return {"message": "RAG API is running"}
\ No newline at end of file
+    return {"message": "RAG API is running"}
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Literal, Optional
 
 class UserCreate(BaseModel):
     '''
@@ -15,12 +15,31 @@ class Token(BaseModel):
     access_token: str
     token_type: str = "bearer"
 
+class IndexConfig(BaseModel):
+    '''
+    Pydantic model for HNSW index settings of a collection. Unset fields use ChromaDB's defaults. The settings only apply when the collection is created; use index_tools.py compact to change them later.
+    '''
+    m: Optional[int] = Field(None, ge=2, le=128) # Max neighbours per node; higher improves recall at the cost of memory
+    ef_construction: Optional[int] = Field(None, ge=1) # Candidate list size while building the index
+    ef_search: Optional[int] = Field(None, ge=1) # Candidate list size while querying; higher improves recall at the cost of latency
+
+class VectorStorageConfig(BaseModel):
+    '''
+    Pydantic model for reduced-precision vector storage of a collection. When set, queries search a compact external index of projected, quantized embeddings and re-score the best candidates on the full-precision vectors, which stay memory-mapped on disk.
+    '''
+    dtype: Literal["float32", "float16", "int8"] = "float16" # Precision of the compact vectors
+    dims: Optional[int] = Field(None, ge=8) # Number of dimensions kept; all dimensions if unset
+    reduction: Literal["truncate", "pca"] = "truncate" # Keep the leading dimensions (Matryoshka-style) or project with PCA
+    oversample: int = Field(4, ge=1, le=100) # Candidates re-scored on full-precision vectors per requested result
+
 class CreateCollection(BaseModel):
     '''
     Pydantic model for creating a new collection. This model defines the expected structure of the data when creating a new collection, including the collection name.
     '''
     name: str = Field(..., min_length=3, max_length=100, pattern=r'^[a-zA-Z0-9][a-zA-Z0-9._-]*[a-zA-Z0-9]$')
     description: Optional[str] = None
+    index: Optional[IndexConfig] = None
+    vector_storage: Optional[VectorStorageConfig] = None
 
 class CollectionInfo(BaseModel):
     '''
@@ -39,6 +58,9 @@ class CrawlRequest(BaseModel):
     chunk_size: Optional[int] = 1000
     max_depth: Optional[int] = 3
     max_concurrent: Optional[int] = 10
+    index: Optional[IndexConfig] = None # HNSW settings used if the collection does not exist yet
+    vector_storage: Optional[VectorStorageConfig] = None # Reduced-precision storage used if the collection does not exist yet
+    dedup: bool = True # Drop duplicate/near-duplicate pages and strip repeated boilerplate before chunking
 
 class ChatRequest(BaseModel):
     '''
@@ -47,6 +69,22 @@ class ChatRequest(BaseModel):
     query: str
     collection_name: str
     top_k: int = 5
+    rerank: Optional[bool] = None # Override RERANK_ENABLED for this request
+
+class BatchSearchRequest(BaseModel):
+    '''
+    Pydantic model for batch search request. This model defines the expected structure of the data when retrieving chunks for many queries at once, including the collection name and the list of queries.
+    '''
+    queries: list[str] = Field(..., min_length=1, max_length=1000)
+    collection_name: str
+    top_k: int = 5
+    rerank: Optional[bool] = None # Override RERANK_ENABLED for this request
+
+class BatchChatRequest(BatchSearchRequest):
+    '''
+    Pydantic model for batch chat request. Extends the batch search request with the number of LLM calls allowed in flight at once.
+    '''
+    max_concurrency: int = Field(4, ge=1) # Capped by BATCH_MAX_LLM_CONCURRENCY
 
 class ChatResponse(BaseModel):
     '''
@@ -0,0 +1,77 @@
+"""Append-only on-disk store for crawled page markdown, so crawls keep only small handles in memory."""
+
+import mmap
+import os
+import tempfile
+import zlib
+from typing import Iterable, Iterator, NamedTuple, Optional, Tuple
+
+
+class PageHandle(NamedTuple):
+    """Location of one crawled page in a PageStore."""
+    url: str
+    canonical: Optional[str]
+    offset: int
+    length: int
+    depth: int = 0
+
+
+class PageStore:
+    """Append-only file of zlib-compressed page markdown, read back through a memory map.
+
+    The backing file is temporary and removed on close. Appends and reads are synchronous, so the
+    store can be shared by crawls running concurrently on the same event loop.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(prefix="pages-", suffix=".store", dir=directory)
+        self._writer = os.fdopen(fd, "wb")
+        self._reader = open(self.path, "rb")
+        self._mmap: Optional[mmap.mmap] = None
+        self._size = 0
+        self.pages = 0
+
+    def append(self, url: str, markdown: str, canonical: Optional[str] = None, depth: int = 0) -> PageHandle:
+        """Compress and append a page's markdown, returning a handle to read it back."""
+        data = zlib.compress(str(markdown).encode("utf-8"), 6)
+        handle = PageHandle(url, canonical, self._size, len(data), depth)
+        self._writer.write(data)
+        self._size += len(data)
+        self.pages += 1
+        return handle
+
+    def read(self, handle: PageHandle) -> str:
+        """Read a page's markdown back from the store."""
+        end = handle.offset + handle.length
+        if self._mmap is None or len(self._mmap) < end:
+            # The file grew since it was last mapped
+            self._writer.flush()
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = mmap.mmap(self._reader.fileno(), 0, access=mmap.ACCESS_READ)
+        return zlib.decompress(self._mmap[handle.offset:end]).decode("utf-8")
+
+    def iter_pages(self, handles: Iterable[PageHandle]) -> Iterator[Tuple[PageHandle, str]]:
+        """Yield each handle with its markdown, reading one page at a time."""
+        for handle in handles:
+            yield handle, self.read(handle)
+
+    def close(self) -> None:
+        """Close the store and delete its backing file."""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._writer.close()
+        self._reader.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self) -> "PageStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
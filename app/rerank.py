@@ -0,0 +1,189 @@
+"""Cross-encoder reranking of retrieved chunks with a bounded CPU cost."""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.logging_config import logger
+
+
+@lru_cache(maxsize=None)
+def get_cross_encoder(model_name: str):
+    """Load a cross-encoder once per process and keep it on the CPU.
+
+    Args:
+        model_name: Name of the cross-encoder model to load
+
+    Returns:
+        A sentence_transformers CrossEncoder
+    """
+    from sentence_transformers import CrossEncoder
+
+    return CrossEncoder(model_name, device="cpu")
+
+
+class ScoreCache:
+    """Thread-safe LRU cache of cross-encoder scores keyed by (collection, query hash, document hash).
+
+    Chunk ids are positional and are reused when a collection is re-crawled, so the key is a hash of
+    the chunk text rather than its id.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._scores: "OrderedDict[Tuple[str, str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[float]:
+        with self._lock:
+            score = self._scores.get(key)
+            if score is not None:
+                self._scores.move_to_end(key)
+            return score
+
+    def put(self, key: Tuple[str, str, str], score: float) -> None:
+        with self._lock:
+            self._scores[key] = score
+            self._scores.move_to_end(key)
+            while len(self._scores) > self.max_size:
+                self._scores.popitem(last=False)
+
+
+class LatencyEstimator:
+    """Exponential moving average of the cross-encoder cost per (query, chunk) pair.
+
+    Calls skipped for being over budget record no sample, so a single slow measurement (torch's
+    one-time setup on the first predict, or a burst of CPU contention) would otherwise keep
+    reranking disabled for good. When no sample was recorded for probe_interval seconds, one
+    call is let through regardless of the estimate so the average can recover.
+    """
+
+    def __init__(self, alpha: float = 0.2, probe_interval: float = 30.0):
+        self.alpha = alpha
+        self.probe_interval = probe_interval
+        self.ms_per_pair: Optional[float] = None
+        self._last_sample = time.monotonic()
+        self._lock = threading.Lock()
+
+    def estimate(self, n_pairs: int) -> float:
+        # Nothing measured yet, so let the first call through to calibrate
+        if self.ms_per_pair is None:
+            return 0.0
+        return self.ms_per_pair * n_pairs
+
+    def take_probe(self) -> bool:
+        """Return True, at most once per probe_interval, when the estimate is due for a fresh sample."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_sample < self.probe_interval:
+                return False
+            self._last_sample = now  # Concurrent callers keep skipping while this probe runs
+            return True
+
+    def observe(self, n_pairs: int, elapsed_ms: float) -> None:
+        if n_pairs == 0:
+            return
+        sample = elapsed_ms / n_pairs
+        with self._lock:
+            self._last_sample = time.monotonic()
+            if self.ms_per_pair is None:
+                self.ms_per_pair = sample
+            else:
+                self.ms_per_pair = self.alpha * sample + (1 - self.alpha) * self.ms_per_pair
+
+
+score_cache = ScoreCache(settings.RERANK_CACHE_SIZE)
+latency_estimator = LatencyEstimator(probe_interval=settings.RERANK_PROBE_INTERVAL_SECONDS)
+
+
+def candidate_count(top_k: int) -> int:
+    """Number of candidates to over-fetch from the collection for a reranked query.
+
+    Args:
+        top_k: Number of results that will be passed to the prompt
+
+    Returns:
+        Number of candidates to request from ChromaDB
+    """
+    return max(top_k, min(top_k * settings.RERANK_FETCH_MULTIPLIER, settings.RERANK_MAX_CANDIDATES))
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _truncate(query_results: Dict[str, Any], top_k: int) -> Dict[str, Any]:
+    """Keep the first top_k hits of a single-query result in ChromaDB's nested list format."""
+    truncated = dict(query_results)
+    for key in ("ids", "documents", "metadatas", "distances"):
+        if query_results.get(key):
+            truncated[key] = [query_results[key][0][:top_k]]
+    return truncated
+
+
+def rerank_results(
+    query_text: str,
+    query_results: Dict[str, Any],
+    top_k: int,
+    collection_name: str = "",
+) -> Dict[str, Any]:
+    """Rerank the hits of a single-query ChromaDB result with a cross-encoder.
+
+    Scores are cached per (collection, query hash, document hash), so only unseen pairs are scored.
+    If scoring the unseen pairs is estimated to exceed RERANK_LATENCY_BUDGET_MS the
+    cosine ordering is kept and the results are only truncated, except for one call every
+    RERANK_PROBE_INTERVAL_SECONDS that is scored anyway to refresh the estimate.
+
+    Args:
+        query_text: The user query
+        query_results: Results from a ChromaDB query with a single query text
+        top_k: Number of results to keep
+        collection_name: Name of the queried collection, used to scope the score cache
+
+    Returns:
+        Query results in the same format as the input, holding at most top_k hits
+    """
+    ids: List[str] = query_results["ids"][0]
+    documents: List[str] = query_results["documents"][0]
+    if len(ids) <= 1:
+        return _truncate(query_results, top_k)
+
+    query_hash = _text_hash(query_text)
+    keys = [(collection_name, query_hash, _text_hash(document)) for document in documents]
+    scores = [score_cache.get(key) for key in keys]
+    missing = [i for i, score in enumerate(scores) if score is None]
+
+    if missing:
+        estimated_ms = latency_estimator.estimate(len(missing))
+        if estimated_ms > settings.RERANK_LATENCY_BUDGET_MS and not latency_estimator.take_probe():
+            logger.info(
+                f"Skipping rerank: {len(missing)} pairs estimated at {estimated_ms:.0f}ms "
+                f"exceeds budget of {settings.RERANK_LATENCY_BUDGET_MS:.0f}ms"
+            )
+            return _truncate(query_results, top_k)
+
+        model = get_cross_encoder(settings.RERANK_MODEL)
+        start = time.perf_counter()
+        new_scores = model.predict(
+            [(query_text, documents[i]) for i in missing],
+            batch_size=settings.RERANK_BATCH_SIZE,
+            show_progress_bar=False,
+        )
+        latency_estimator.observe(len(missing), (time.perf_counter() - start) * 1000)
+
+        for i, score in zip(missing, new_scores):
+            scores[i] = float(score)
+            score_cache.put(keys[i], scores[i])
+
+    order = sorted(range(len(ids)), key=lambda i: scores[i], reverse=True)[:top_k]
+
+    reranked = dict(query_results)
+    for key in ("ids", "documents", "metadatas", "distances"):
+        if query_results.get(key):
+            reranked[key] = [[query_results[key][0][i] for i in order]]
+    reranked["rerank_scores"] = [[scores[i] for i in order]]
+    return reranked
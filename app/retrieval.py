@@ -0,0 +1,56 @@
+"""Retrieval of context chunks shared by the chat and search routes."""
+
+from typing import Any, Dict, List, Optional
+
+import chromadb
+
+from app.config import settings
+from app.rerank import candidate_count, rerank_results
+from app.utils import query_collection_batch, split_query_results
+from app.vector_index import load_vector_index
+
+
+def retrieve_many(
+    collection: chromadb.Collection,
+    queries: List[str],
+    top_k: int,
+    rerank: Optional[bool] = None,
+) -> List[Dict[str, Any]]:
+    """Retrieve the chunks for several queries with one embedding pass and one multi-query search.
+
+    Collections with an external reduced-precision index are searched through it. When reranking is
+    enabled, candidates are over-fetched and each query keeps its top_k best according to the cross-encoder.
+
+    Args:
+        collection: ChromaDB collection
+        queries: Query texts
+        top_k: Number of results per query
+        rerank: Override RERANK_ENABLED if not None
+
+    Returns:
+        One single-query result per query, in the format returned by query_collection
+    """
+    vector_index = load_vector_index(collection, settings.CHROMA_DB_DIR)
+    use_rerank = settings.RERANK_ENABLED if rerank is None else rerank
+    n_results = candidate_count(top_k) if use_rerank else top_k
+
+    results = split_query_results(query_collection_batch(collection, queries, n_results=n_results, vector_index=vector_index))
+    if not use_rerank:
+        return results
+    return [
+        rerank_results(query, candidates, top_k, collection_name=collection.name)
+        for query, candidates in zip(queries, results)
+    ]
+
+
+def build_sources(results: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Build the list of sources returned to the client from single-query results."""
+    sources = []
+    if results["metadatas"] and results["metadatas"][0]:
+        for meta, dist in zip(results["metadatas"][0], results["distances"][0]):
+            sources.append({
+                "source": meta.get("source", "unknown"),
+                "relevance": round(1 - dist, 3),
+                "headers": meta.get("headers", ""),
+            })
+    return sources
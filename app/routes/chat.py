@@ -1,45 +1,57 @@
+from functools import lru_cache
 from fastapi import APIRouter, Depends, HTTPException
-from openai import OpenAI
+from fastapi.responses import StreamingResponse
 from app.auth import get_current_user
-from app.models import ChatRequest, ChatResponse
+from app.models import ChatRequest, ChatResponse, BatchChatRequest
 from app.config import settings
-from app.utils import get_chroma_client, get_or_create_collection, query_collection, format_results_as_context
+from app.utils import get_app_chroma_client, get_or_create_collection, format_results_as_context
+from app.retrieval import retrieve_many, build_sources
+import asyncio
 import json
 from sse_starlette.sse import EventSourceResponse
 
 router = APIRouter(prefix="/chat", tags=["chat"])
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
+
+@lru_cache(maxsize=None)
+def get_openai_client():
+    '''
+    Create the OpenAI client on first use instead of at import time, so importing this router stays cheap.
+    '''
+    from openai import OpenAI
+
+    return OpenAI(api_key=settings.OPENAI_API_KEY)
+
+SYSTEM_PROMPT = (
+    "You are a helpful assistant that answers questions based on the provided context. "
+    "If the context doesn't contain enough information to answer, say so. "
+    "Always cite which source URLs your answer came from."
+)
+
+def retrieve(collection, request: ChatRequest) -> dict:
+    '''
+    Retrieve the chunks used as context for a chat request. See retrieve_many.
+    '''
+    return retrieve_many(collection, [request.query], request.top_k, rerank=request.rerank)[0]
 
 @router.post("/stream")
 async def chat_stream(request: ChatRequest, current_user: dict = Depends(get_current_user)):
     try:
-        chroma_client = get_chroma_client(settings.CHROMA_DB_DIR)
+        chroma_client = get_app_chroma_client()
         collection = get_or_create_collection(chroma_client, request.collection_name, embedding_model_name=settings.EMBEDDING_MODEL)
     except Exception as e:
         raise HTTPException(status_code=404, detail=f"Collection error: {str(e)}")
 
-    # Retrieve relevant chunks
-    results = query_collection(collection, request.query, n_results=request.top_k)
+    # Retrieve relevant chunks. Embedding and reranking are CPU bound, so keep them off the event loop
+    results = await asyncio.to_thread(retrieve, collection, request)
     context = format_results_as_context(results)
 
     # Build the prompt
-    system_prompt = (
-        "You are a helpful assistant that answers questions based on the provided context. "
-        "If the context doesn't contain enough information to answer, say so. "
-        "Always cite which source URLs your answer came from."
-    )
+    system_prompt = SYSTEM_PROMPT
 
     user_prompt = f"{context}\n\nQUESTION: {request.query}"
 
     # Build sources before streaming starts
-    sources = []
-    if results["metadatas"] and results["metadatas"][0]:
-        for meta, dist in zip(results["metadatas"][0], results["distances"][0]):
-            sources.append({
-                "source": meta.get("source", "unknown"),
-                "relevance": round(1 - dist, 3),
-                "headers": meta.get("headers", ""),
-            })
+    sources = build_sources(results)
 
     async def event_generator():
         try:
@@ -47,7 +59,7 @@ async def chat_stream(request: ChatRequest, current_user: dict = Depends(get_cur
             yield {"event": "sources", "data": json.dumps(sources)}
 
             # Stream the LLM response
-            stream = client.chat.completions.create(
+            stream = get_openai_client().chat.completions.create(
                 model=settings.OPENAI_MODEL,
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -83,27 +95,23 @@ async def chat(request: ChatRequest, current_user: dict = Depends(get_current_us
     :type current_user: dict
     '''
     try:
-        chroma_client = get_chroma_client(settings.CHROMA_DB_DIR)
+        chroma_client = get_app_chroma_client()
         collection = get_or_create_collection(chroma_client, request.collection_name, embedding_model_name=settings.EMBEDDING_MODEL)
     except Exception as e:
         raise HTTPException(status_code=404, detail=f"Collection error: {str(e)}")
 
-    # Retrieve relevant chunks
-    results = query_collection(collection, request.query, n_results=request.top_k)
+    # Retrieve relevant chunks. Embedding and reranking are CPU bound, so keep them off the event loop
+    results = await asyncio.to_thread(retrieve, collection, request)
     context = format_results_as_context(results)
 
     # Build the prompt
-    system_prompt = (
-        "You are a helpful assistant that answers questions based on the provided context. "
-        "If the context doesn't contain enough information to answer, say so. "
-        "Always cite which source URLs your answer came from."
-    )
+    system_prompt = SYSTEM_PROMPT
 
     user_prompt = f"{context}\n\nQUESTION: {request.query}"
 
     # Call OpenAI
     try:
-        response = client.chat.completions.create(
+        response = get_openai_client().chat.completions.create(
             model=settings.OPENAI_MODEL,
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -115,13 +123,59 @@ async def chat(request: ChatRequest, current_user: dict = Depends(get_current_us
         raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
 
     # Build sources list from metadata
-    sources = []
-    if results["metadatas"] and results["metadatas"][0]:
-        for meta, dist in zip(results["metadatas"][0], results["distances"][0]):
-            sources.append({
-                "source": meta.get("source", "unknown"),
-                "relevance": round(1 - dist, 3),
-                "headers": meta.get("headers", ""),
-            })
-
-    return ChatResponse(answer=answer, sources=sources)
\ No newline at end of file
+    sources = build_sources(results)
+
+    return ChatResponse(answer=answer, sources=sources)
+
+@router.post("/batch")
+async def chat_batch(request: BatchChatRequest, current_user: dict = Depends(get_current_user)):
+    '''
+    Answer many queries against one collection, for evaluation jobs and bulk generation. Requires user authentication.
+    Retrieval for all queries runs as one embedding pass and one multi-query search, then the LLM calls fan out with at
+    most max_concurrency in flight. Results are streamed back as NDJSON, one line per query in completion order, each
+    carrying the index of its query.
+    '''
+    try:
+        chroma_client = get_app_chroma_client()
+        collection = get_or_create_collection(chroma_client, request.collection_name, embedding_model_name=settings.EMBEDDING_MODEL)
+    except Exception as e:
+        raise HTTPException(status_code=404, detail=f"Collection error: {str(e)}")
+
+    # Retrieval is CPU bound, so keep it off the event loop
+    all_results = await asyncio.to_thread(retrieve_many, collection, request.queries, request.top_k, request.rerank)
+
+    semaphore = asyncio.Semaphore(min(request.max_concurrency, settings.BATCH_MAX_LLM_CONCURRENCY))
+
+    def generate(query: str, results: dict) -> str:
+        response = get_openai_client().chat.completions.create(
+            model=settings.OPENAI_MODEL,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": f"{format_results_as_context(results)}\n\nQUESTION: {query}"},
+            ],
+        )
+        return response.choices[0].message.content
+
+    async def answer(index: int, query: str, results: dict) -> dict:
+        line = {"index": index, "query": query, "sources": build_sources(results)}
+        async with semaphore:
+            try:
+                line["answer"] = await asyncio.to_thread(generate, query, results)
+            except Exception as e:
+                line["error"] = f"OpenAI API error: {str(e)}"
+        return line
+
+    async def line_generator():
+        tasks = [
+            asyncio.create_task(answer(i, query, results))
+            for i, (query, results) in enumerate(zip(request.queries, all_results))
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield json.dumps(await task) + "\n"
+        finally:
+            # Stop pending LLM calls if the client disconnects
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(line_generator(), media_type="application/x-ndjson")
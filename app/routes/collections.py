@@ -2,10 +2,10 @@ from fastapi import APIRouter, Depends, HTTPException
 from app.auth import get_current_user
 from app.config import settings
 from app.models import CreateCollection, CollectionInfo
+from app.utils import get_app_chroma_client, get_or_create_collection, hnsw_metadata
+from app.vector_index import storage_metadata, delete_vector_index
 import chromadb
 
-chroma_client = chromadb.PersistentClient(path=settings.CHROMA_DB_DIR)
-
 router = APIRouter(prefix="/collections", tags=["collections"])
 
 @router.get("/")
@@ -14,6 +14,7 @@ def list_collections(current_user: str = Depends(get_current_user)):
     Endpoint to list all collections in the ChromaDB database. Requires user authentication.
     Returns a list of collection names.
     '''
+    chroma_client = get_app_chroma_client()
     collections = chroma_client.list_collections()
     return [col.name for col in collections]
 
@@ -21,11 +22,14 @@ def list_collections(current_user: str = Depends(get_current_user)):
 def create_collection(collection: CreateCollection, current_user: str = Depends(get_current_user)):
     '''
     Endpoint to create a new collection in the ChromaDB database. Requires user authentication.
-    Accepts a collection name as input and creates the collection if it does not already exist.
+    Accepts a collection name and optional HNSW index and vector storage settings as input and creates the collection if it does not already exist.
     Returns the collection information or an error message if the collection already exists.
     '''
     try:
-        collection = chroma_client.get_or_create_collection(name=collection.name)
+        chroma_client = get_app_chroma_client()
+        hnsw_config = hnsw_metadata(**collection.index.model_dump()) if collection.index else None
+        metadata = storage_metadata(collection.vector_storage) if collection.vector_storage else None
+        collection = get_or_create_collection(chroma_client, collection.name, embedding_model_name=settings.EMBEDDING_MODEL, hnsw_config=hnsw_config, metadata=metadata)
         return {"name": collection.name, "document_count": collection.count()}
     except chromadb.errors.InvalidArgumentError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -38,7 +42,9 @@ def delete_collection(name: str, current_user: dict = Depends(get_current_user))
     Returns a success message or an error message if the collection does not exist.
     '''
     try:
+        chroma_client = get_app_chroma_client()
         chroma_client.delete_collection(name=name)
+        delete_vector_index(settings.CHROMA_DB_DIR, name)
         return {"message": f"Collection '{name}' deleted successfully"}
     except chromadb.errors.InvalidArgumentError as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -1,102 +1,228 @@
+import asyncio
+import json
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional
 from fastapi import APIRouter, Depends, HTTPException
+from crawl4ai import AsyncWebCrawler, BrowserConfig
+from sse_starlette.sse import EventSourceResponse
 from app.auth import get_current_user
 from app.models import CrawlRequest
 from app.config import settings
-from app.insert_docs import smart_chunk_markdown, is_sitemap, is_txt, crawl_recursive_internal_links, crawl_markdown_file, parse_sitemap, crawl_batch, extract_section_info
-from app.utils import get_chroma_client, get_or_create_collection, add_documents_to_collection
+from app.insert_docs import crawl_url, index_pages
+from app.utils import get_app_chroma_client, get_or_create_collection, hnsw_metadata
+from app.dedup import dedupe_pages
+from app.page_store import PageStore
+from app.scheduler import CrawlBudget, CrawlScheduler
+from app.vector_index import storage_metadata, sync_vector_index
+from app.logging_config import logger
 
 router = APIRouter(prefix="/crawl", tags=["crawl"])
 
+# Shared by every crawl request served by this process
+crawl_scheduler = CrawlScheduler(
+    settings.MAX_CRAWL_SLOTS,
+    settings.MAX_CRAWL_SLOTS_PER_USER,
+    memory_threshold_percent=settings.CRAWL_MEMORY_THRESHOLD_PERCENT,
+)
+
+# Emits a progress event (name, data) to the client of a streaming crawl
+EmitCallback = Callable[[str, Dict[str, Any]], None]
+
+class CrawlProgress:
+    '''
+    Counts fetched and indexed pages of one crawl request and computes a rolling fetch rate over the last window_seconds.
+    '''
+    def __init__(self, window_seconds: float = 10.0):
+        self.window_seconds = window_seconds
+        self.started = time.monotonic()
+        self.pages_fetched = 0
+        self.pages_failed = 0
+        self.pages_indexed = 0
+        self.chunks_indexed = 0
+        self._fetch_times = deque()
+
+    def fetched(self, ok: bool) -> None:
+        now = time.monotonic()
+        self.pages_fetched += 1
+        self.pages_failed += 0 if ok else 1
+        self._fetch_times.append(now)
+        while self._fetch_times and self._fetch_times[0] < now - self.window_seconds:
+            self._fetch_times.popleft()
+
+    def pages_per_sec(self) -> float:
+        window = min(self.window_seconds, time.monotonic() - self.started)
+        return round(len(self._fetch_times) / window, 2) if window > 0 else 0.0
+
+async def run_in_thread(func: Callable, *args, **kwargs):
+    '''
+    Run a blocking function in a worker thread and wait for it to finish, even if the caller is cancelled. Cancelling
+    asyncio.to_thread only stops waiting for the thread, so the page store would be closed and deleted while the thread
+    is still reading it. Cancellation is re-raised once the thread is done.
+    '''
+    task = asyncio.ensure_future(asyncio.to_thread(func, *args, **kwargs))
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        while not task.done():
+            try:
+                await asyncio.wait([task])
+            except asyncio.CancelledError:
+                pass
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"{func.__name__} failed after the crawl request was cancelled: {task.exception()}")
+        raise
+
+async def run_crawl(request: CrawlRequest, current_user: dict, emit: Optional[EmitCallback] = None) -> Dict[str, Any]:
+    '''
+    Crawl the request's URLs, deduplicate the pages, and chunk and index them into the collection. Returns the
+    crawl summary and raises HTTPException on failure. When emit is given, it receives a "page" event for every
+    fetched page, a "dedup" event, and an "indexed" event for every page whose chunks were inserted. emit must
+    be safe to call from a worker thread.
+
+    If the caller is cancelled, crawling stops right away. Deduplication and indexing are not interrupted: once
+    insertion has started, all pages are inserted and the vector index is synced before the cancellation takes effect,
+    so the collection is never left half-updated.
+    '''
+    progress = CrawlProgress()
+
+    def on_fetch(event: Dict[str, Any]) -> None:
+        progress.fetched(event["status"] == "ok")
+        if emit:
+            emit("page", {
+                **event,
+                "pages_fetched": progress.pages_fetched,
+                "pages_failed": progress.pages_failed,
+                "pages_per_sec": progress.pages_per_sec(),
+                "memory_percent": crawl_scheduler.memory_percent(),
+                "active_slots": crawl_scheduler.active,
+            })
+
+    def on_indexed(event: Dict[str, Any]) -> None:
+        progress.pages_indexed += 1
+        progress.chunks_indexed += event["chunks"]
+        if emit:
+            emit("indexed", {**event, "pages_indexed": progress.pages_indexed, "chunks_indexed": progress.chunks_indexed})
+
+    # Crawled markdown is written to an on-disk page store; only small handles are kept in memory.
+    with PageStore(settings.PAGE_STORE_DIR) as store:
+        # All seed URLs are crawled concurrently by one browser and share the request's concurrency
+        # budget, which itself draws slots from the server-wide scheduler.
+        budget = CrawlBudget(crawl_scheduler, current_user["username"], request.max_concurrent)
+        async with AsyncWebCrawler(config=BrowserConfig(headless=True, verbose=False)) as crawler:
+            results = await asyncio.gather(*(
+                crawl_url(url, store, budget, crawler=crawler, max_depth=request.max_depth, on_page=on_fetch)
+                for url in request.urls
+            ))
+
+        # Flatten the per-URL handle lists into a single list, in the order the URLs were given
+        all_handles = [handle for handles in results for handle in handles]
+
+        # Check if we got anything to process
+        if not all_handles:
+            raise HTTPException(status_code=400, detail="No content was successfully crawled from any of the provided URLs")
+
+        pages_crawled = len(all_handles)
+
+        # Drop duplicate pages and boilerplate across all seed URLs so they are not embedded several times
+        dedup_stats = {}
+        boilerplate = set()
+        if request.dedup:
+            all_handles, boilerplate, dedup_stats = await run_in_thread(dedupe_pages, store, all_handles)
+            if emit:
+                emit("dedup", {**dedup_stats, "pages_crawled": pages_crawled, "pages_kept": len(all_handles)})
+
+        try:
+            # Get a ChromaDB client pointing to our persistence directory
+            client = get_app_chroma_client()
+
+            # Get existing collection or create new one
+            hnsw_config = hnsw_metadata(**request.index.model_dump()) if request.index else None
+            metadata = storage_metadata(request.vector_storage) if request.vector_storage else None
+            collection = get_or_create_collection(client, request.collection_name, embedding_model_name=settings.EMBEDDING_MODEL, hnsw_config=hnsw_config, metadata=metadata)
+
+            def index_and_sync() -> int:
+                # Chunk pages and insert the chunks in batches as they are produced
+                inserted = index_pages(
+                    store, all_handles, collection,
+                    chunk_size=request.chunk_size, boilerplate=boilerplate, batch_size=100, on_page=on_indexed,
+                )
+                # Update the reduced-precision index if the collection uses one
+                sync_vector_index(collection, settings.CHROMA_DB_DIR, settings.EMBEDDING_MODEL)
+                return inserted
+
+            # Embedding is CPU bound, so it runs in a worker thread to keep the event loop (and progress
+            # streaming) responsive. Insertion and the index sync always run to completion together.
+            chunks_inserted = await run_in_thread(index_and_sync)
+
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to insert documents into ChromaDB: {str(e)}")
+
+    if not chunks_inserted:
+        raise HTTPException(status_code=400, detail="Crawling succeeded but no text content was extracted")
+
+    return {
+        "message": f"Successfully crawled and inserted {chunks_inserted} chunks",
+        "collection": request.collection_name,
+        "chunks_inserted": chunks_inserted,
+        "urls_processed": len(request.urls),
+        "pages_crawled": pages_crawled,
+        "pages_indexed": len(all_handles),
+        "dedup": dedup_stats,
+        "elapsed_sec": round(time.monotonic() - progress.started, 2),
+    }
+
 @router.post("/")
-async def crawl_website(request: CrawlRequest, current_user: str = Depends(get_current_user)):
+async def crawl_website(request: CrawlRequest, current_user: dict = Depends(get_current_user)):
     """
     Crawl one or more URLs and store the chunked content in a ChromaDB collection.
-    
+
     This endpoint handles three types of URLs:
     - .txt files: Single markdown/text file fetch
     - Sitemaps: Parse XML to get all URLs, then batch crawl them
     - Regular pages: Recursively crawl following internal links
+
+    All URLs are crawled concurrently under one budget of max_concurrent pages in flight, and every
+    page fetch also takes a slot from the server-wide crawl scheduler.
+    """
+    return await run_crawl(request, current_user)
+
+@router.post("/stream")
+async def crawl_stream(request: CrawlRequest, current_user: dict = Depends(get_current_user)):
+    """
+    Same crawl as POST /crawl/, reporting progress as server-sent events while it runs:
+    - page: a page was fetched (url, status, status_code, depth, pages_fetched, pages_failed, pages_per_sec, memory_percent, active_slots)
+    - dedup: deduplication finished (duplicate_urls, near_duplicates, canonical_mismatches, boilerplate_blocks, pages_crawled, pages_kept)
+    - indexed: a page's chunks were inserted (url, depth, chunks, pages_indexed, chunks_indexed)
+    - done: the crawl summary returned by POST /crawl/
+    - error: the crawl failed (status_code, detail)
     """
-    
-    # Collect all crawl results first, then process them together.
-    all_crawl_results = []
-    
-    for url in request.urls:
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+
+    def emit(event: str, data: Dict[str, Any]) -> None:
+        # Called from the event loop while crawling and from a worker thread while indexing
+        loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+    async def crawl_task():
         try:
-            if is_txt(url):
-                results = await crawl_markdown_file(url)
-            
-            elif is_sitemap(url):
-                # Parse the XML to extract all page URLs then crawl all of them in parallel
-                sitemap_urls = parse_sitemap(url)
-                if not sitemap_urls: # Don't fail it if sitemap is empty, just skip to next URL
-                    continue
-
-                # crawl_batch handles parallel crawling with concurrency limits
-                results = await crawl_batch(sitemap_urls, max_concurrent=request.max_concurrent)
-            
-            else:
-                results = await crawl_recursive_internal_links([url], max_depth=request.max_depth, max_concurrent=request.max_concurrent)
-            
-            # Using append would create a nested list, we want to flatten it into a single list of crawl results
-            all_crawl_results.extend(results)
-            
+            summary = await run_crawl(request, current_user, emit)
+            emit("done", summary)
+        except HTTPException as e:
+            emit("error", {"status_code": e.status_code, "detail": e.detail})
         except Exception as e:
-            print(f"Error crawling {url}: {e}")
-            continue
-    
-    # Check if we got anything to process
-    if not all_crawl_results:
-        raise HTTPException(status_code=400, detail="No content was successfully crawled from any of the provided URLs")
-    
-    # ChromaDB needs three parallel lists
-    ids = []
-    documents = []
-    metadatas = []
-    chunk_idx = 0  # Global counter across all documents for unique IDs
-    
-    for doc in all_crawl_results:
-        source_url = doc['url']
-        markdown_content = doc['markdown']
-        
-        chunks = smart_chunk_markdown(markdown_content, max_len=request.chunk_size)
-        
-        for chunk in chunks:
-            # Create a unique ID for this chunk
-            ids.append(f"chunk-{chunk_idx}")
-            
-            # The actual text content that will be embedded and searched
-            documents.append(chunk)
-            
-            # Metadata for this chunk
-            meta = extract_section_info(chunk)
-            meta["chunk_index"] = chunk_idx
-            meta["source"] = source_url  # Track which URL this came from
-            metadatas.append(meta)
-            
-            chunk_idx += 1
-    
-    if not documents:
-        raise HTTPException(status_code=400, detail="Crawling succeeded but no text content was extracted")
-    
-    try:
-        # Get a ChromaDB client pointing to our persistence directory
-        client = get_chroma_client(settings.CHROMA_DB_DIR)
-        
-        # Get existing collection or create new one
-        collection = get_or_create_collection(client, request.collection_name, embedding_model_name=settings.EMBEDDING_MODEL)
-        
-        # Insert all chunks in batches 
-        add_documents_to_collection(collection, ids, documents, metadatas, batch_size=100)
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to insert documents into ChromaDB: {str(e)}")
-    
-    return {
-        "message": f"Successfully crawled and inserted {len(documents)} chunks",
-        "collection": request.collection_name,
-        "chunks_inserted": len(documents),
-        "urls_processed": len(request.urls),
-        "pages_crawled": len(all_crawl_results)
-    }
-        
\ No newline at end of file
+            emit("error", {"status_code": 500, "detail": str(e)})
+
+    async def event_generator():
+        task = asyncio.create_task(crawl_task())
+        try:
+            while True:
+                event, data = await events.get()
+                yield {"event": event, "data": json.dumps(data)}
+                if event in ("done", "error"):
+                    break
+        finally:
+            # Stop crawling if the client disconnects. Indexing that has already started still runs to completion.
+            task.cancel()
+
+    return EventSourceResponse(event_generator())
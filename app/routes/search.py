@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from app.auth import get_current_user
+from app.models import BatchSearchRequest
+from app.config import settings
+from app.utils import get_app_chroma_client, get_or_create_collection
+from app.retrieval import retrieve_many
+import asyncio
+import json
+
+router = APIRouter(prefix="/search", tags=["search"])
+
+@router.post("/batch")
+async def search_batch(request: BatchSearchRequest, current_user: dict = Depends(get_current_user)):
+    '''
+    Retrieve the top_k chunks for many queries against one collection, without calling the LLM. Requires user authentication.
+    All queries are embedded in one pass and searched with one multi-query request. Results are streamed back as NDJSON,
+    one line per query in request order.
+    '''
+    try:
+        chroma_client = get_app_chroma_client()
+        collection = get_or_create_collection(chroma_client, request.collection_name, embedding_model_name=settings.EMBEDDING_MODEL)
+    except Exception as e:
+        raise HTTPException(status_code=404, detail=f"Collection error: {str(e)}")
+
+    # Retrieval is CPU bound, so keep it off the event loop
+    all_results = await asyncio.to_thread(retrieve_many, collection, request.queries, request.top_k, request.rerank)
+
+    def line_generator():
+        for i, (query, results) in enumerate(zip(request.queries, all_results)):
+            hits = [
+                {"id": chunk_id, "document": doc, "metadata": meta, "relevance": round(1 - dist, 3)}
+                for chunk_id, doc, meta, dist in zip(
+                    results["ids"][0], results["documents"][0], results["metadatas"][0], results["distances"][0]
+                )
+            ]
+            yield json.dumps({"index": i, "query": query, "results": hits}) + "\n"
+
+    return StreamingResponse(line_generator(), media_type="application/x-ndjson")
@@ -0,0 +1,122 @@
+"""Crawl slot scheduling: server-wide and per-user limits with fair sharing between users."""
+
+import asyncio
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Hashable
+
+import psutil
+
+
+class CrawlScheduler:
+    """Hands out crawl slots (one slot = one page being fetched) across all requests of the server.
+
+    At most max_slots pages are fetched at once overall and at most max_slots_per_user for any one
+    user. Waiting users are served round-robin, so a user with a huge crawl gets one slot in turn
+    with every other waiting user instead of taking every slot that frees up. Like crawl4ai's
+    MemoryAdaptiveDispatcher, no new slot is granted while system memory use is above
+    memory_threshold_percent, except when nothing is running.
+
+    Limits are per process; run crawls from a single process (APP_ROLE=crawl) to enforce them server-wide.
+    """
+
+    def __init__(self, max_slots: int, max_slots_per_user: int, memory_threshold_percent: float = 70.0):
+        self.max_slots = max_slots
+        self.max_slots_per_user = max_slots_per_user
+        self.memory_threshold_percent = memory_threshold_percent
+        self.active = 0
+        self._active_by_user: Counter = Counter()
+        self._waiters: Dict[Hashable, Deque[asyncio.Future]] = {}
+        self._turns: Deque[Hashable] = deque()
+
+    def memory_percent(self) -> float:
+        return psutil.virtual_memory().percent
+
+    def _can_grant(self, user: Hashable) -> bool:
+        return self.active < self.max_slots and self._active_by_user[user] < self.max_slots_per_user
+
+    def _grant(self, user: Hashable) -> None:
+        self.active += 1
+        self._active_by_user[user] += 1
+
+    def _dispatch(self) -> None:
+        """Grant free slots to waiting users in round-robin order."""
+        while self._turns and self.active < self.max_slots:
+            if self.active > 0 and self.memory_percent() >= self.memory_threshold_percent:
+                return
+
+            for _ in range(len(self._turns)):
+                user = self._turns[0]
+                self._turns.rotate(-1)
+                if self._active_by_user[user] < self.max_slots_per_user:
+                    break
+            else:
+                return  # Every waiting user is at their own limit
+
+            waiters = self._waiters[user]
+            future = waiters.popleft()
+            if not waiters:
+                del self._waiters[user]
+                self._turns.remove(user)
+            self._grant(user)
+            future.set_result(None)
+
+    async def acquire(self, user: Hashable) -> None:
+        """Wait for a crawl slot for the given user."""
+        if not self._waiters and self._can_grant(user) and (
+            self.active == 0 or self.memory_percent() < self.memory_threshold_percent
+        ):
+            self._grant(user)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        if user not in self._waiters:
+            self._waiters[user] = deque()
+            self._turns.append(user)
+        self._waiters[user].append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(user)  # Granted right as we were cancelled
+            elif future in self._waiters.get(user, ()):
+                self._waiters[user].remove(future)
+                if not self._waiters[user]:
+                    del self._waiters[user]
+                    self._turns.remove(user)
+            raise
+
+    def release(self, user: Hashable) -> None:
+        """Return a crawl slot and hand free slots to waiting users."""
+        self.active -= 1
+        self._active_by_user[user] -= 1
+        if not self._active_by_user[user]:
+            del self._active_by_user[user]
+        self._dispatch()
+
+
+class CrawlBudget:
+    """Concurrency budget of one crawl request, shared by all of its seed URLs.
+
+    A slot requires both one of the request's max_concurrent permits and a slot from the scheduler.
+    """
+
+    def __init__(self, scheduler: CrawlScheduler, user: Hashable, max_concurrent: int):
+        self.scheduler = scheduler
+        self.user = user
+        self.max_concurrent = max_concurrent
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        async with self._semaphore:
+            await self.scheduler.acquire(self.user)
+            try:
+                yield
+            finally:
+                self.scheduler.release(self.user)
+
+
+def local_budget(max_concurrent: int) -> CrawlBudget:
+    """Budget for a crawl that does not share limits with anything else, such as the CLI."""
+    return CrawlBudget(CrawlScheduler(max_concurrent, max_concurrent), "local", max_concurrent)
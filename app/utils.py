@@ -1,35 +1,161 @@
 """Utility functions for text processing and ChromaDB operations."""
 
+import errno
 import os
 import pathlib
+from functools import lru_cache
 from typing import List, Dict, Any, Optional
 
 import chromadb
+from chromadb.api import ClientAPI
 from chromadb.utils import embedding_functions
 from more_itertools import batched
 
 
-def get_chroma_client(persist_directory: str) -> chromadb.PersistentClient:
+# Clients are cached per process id so a client created before a pre-fork server
+# forks its workers is never shared with (and reused by) a child process.
+_chroma_clients: Dict[tuple, ClientAPI] = {}
+
+
+def get_chroma_client(
+    persist_directory: str,
+    host: Optional[str] = None,
+    port: int = 8000,
+) -> ClientAPI:
     """Get a ChromaDB client with the specified persistence directory.
     
+    When a host is given the client talks to a ChromaDB server, which is the
+    supported setup for running several workers or replicas. Otherwise ChromaDB
+    is embedded in the process and persists to persist_directory.
+    
     Args:
         persist_directory: Directory where ChromaDB will store its data
+        host: Optional host of a ChromaDB server
+        port: Port of the ChromaDB server
         
     Returns:
-        A ChromaDB PersistentClient
+        A ChromaDB client, reused for the lifetime of the current process
+    """
+    key = (os.getpid(), persist_directory, host, port)
+    if key in _chroma_clients:
+        return _chroma_clients[key]
+
+    if host:
+        client = chromadb.HttpClient(host=host, port=port)
+    else:
+        # Create the directory if it doesn't exist
+        os.makedirs(persist_directory, exist_ok=True)
+        client = chromadb.PersistentClient(persist_directory)
+
+    _chroma_clients[key] = client
+    return client
+
+
+def get_app_chroma_client() -> ClientAPI:
+    """Get the ChromaDB client configured for the API by CHROMA_DB_DIR, CHROMA_HOST and CHROMA_PORT.
+
+    All API code should use this instead of calling get_chroma_client with the settings, so no call
+    site can forget the host and open an embedded database in a multi-worker deployment.
+
+    Returns:
+        A ChromaDB client, reused for the lifetime of the current process
+    """
+    # Imported here so the CLI tools, which pass their own options, do not need the API settings
+    from app.config import settings
+
+    return get_chroma_client(settings.CHROMA_DB_DIR, host=settings.CHROMA_HOST, port=settings.CHROMA_PORT)
+
+
+# Errors raised by flock / msvcrt.locking when another process holds the lock
+_LOCK_HELD_ERRNOS = {errno.EWOULDBLOCK, errno.EAGAIN, errno.EACCES, getattr(errno, "EDEADLOCK", errno.EDEADLK)}
+
+# Open lock files of the embedded ChromaDB directories claimed by this process, keyed by (pid, directory)
+_chroma_locks: Dict[tuple, Any] = {}
+
+
+def claim_embedded_chroma(persist_directory: str) -> bool:
+    """Take an exclusive, process-lifetime lock on an embedded ChromaDB directory.
+
+    The lock is released by the OS when the process exits. It detects a second process opening
+    the same directory however it was started (uvicorn --workers, gunicorn -w, another replica
+    or the CLI), which an environment variable check cannot.
+
+    Args:
+        persist_directory: Directory of the embedded ChromaDB
+
+    Returns:
+        False if another process already holds the lock, True otherwise
+
+    Raises:
+        OSError: If the lock file cannot be opened or locked for any other reason
     """
-    # Create the directory if it doesn't exist
+    key = (os.getpid(), os.path.abspath(persist_directory))
+    if key in _chroma_locks:
+        return True
+
     os.makedirs(persist_directory, exist_ok=True)
+    lock_file = open(os.path.join(persist_directory, ".process.lock"), "a+")
+    try:
+        if os.name == "nt":
+            import msvcrt
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError as e:
+        lock_file.close()
+        if e.errno in _LOCK_HELD_ERRNOS:
+            return False
+        raise
+
+    _chroma_locks[key] = lock_file
+    return True
+
+
+@lru_cache(maxsize=None)
+def get_embedding_function(model_name: str) -> embedding_functions.SentenceTransformerEmbeddingFunction:
+    """Get the SentenceTransformer embedding function for a model, loading it once per process.
     
-    # Return the client
-    return chromadb.PersistentClient(persist_directory)
+    Args:
+        model_name: Name of the embedding model to use
+        
+    Returns:
+        A ChromaDB embedding function
+    """
+    return embedding_functions.SentenceTransformerEmbeddingFunction(model_name=model_name)
+
+
+def hnsw_metadata(
+    m: Optional[int] = None,
+    ef_construction: Optional[int] = None,
+    ef_search: Optional[int] = None,
+) -> Dict[str, int]:
+    """Build the ChromaDB collection metadata for HNSW index settings, leaving out unset values.
+    
+    Args:
+        m: Max number of neighbours per node (hnsw:M)
+        ef_construction: Candidate list size while building the index (hnsw:construction_ef)
+        ef_search: Candidate list size while querying (hnsw:search_ef)
+        
+    Returns:
+        Metadata entries to merge into the collection metadata
+    """
+    settings_by_key = {
+        "hnsw:M": m,
+        "hnsw:construction_ef": ef_construction,
+        "hnsw:search_ef": ef_search,
+    }
+    return {key: value for key, value in settings_by_key.items() if value is not None}
 
 
 def get_or_create_collection(
-    client: chromadb.PersistentClient,
+    client: ClientAPI,
     collection_name: str,
     embedding_model_name: str = "all-MiniLM-L6-v2",
     distance_function: str = "cosine",
+    hnsw_config: Optional[Dict[str, int]] = None,
+    metadata: Optional[Dict[str, Any]] = None,
 ) -> chromadb.Collection:
     """Get an existing collection or create a new one if it doesn't exist.
     
@@ -38,14 +164,14 @@ def get_or_create_collection(
         collection_name: Name of the collection
         embedding_model_name: Name of the embedding model to use
         distance_function: Distance function to use for similarity search
+        hnsw_config: Optional HNSW metadata from hnsw_metadata, only applied when the collection is created
+        metadata: Optional additional collection metadata, only applied when the collection is created
         
     Returns:
         A ChromaDB Collection
     """
-    # Create embedding function
-    embedding_func = embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name=embedding_model_name
-    )
+    # Shared embedding function, so the model is loaded once per process
+    embedding_func = get_embedding_function(embedding_model_name)
     
     # Try to get the collection, create it if it doesn't exist
     try:
@@ -57,7 +183,7 @@ def get_or_create_collection(
         return client.create_collection(
             name=collection_name,
             embedding_function=embedding_func,
-            metadata={"hnsw:space": distance_function}
+            metadata={"hnsw:space": distance_function, **(hnsw_config or {}), **(metadata or {})}
         )
 
 
@@ -103,6 +229,7 @@ def query_collection(
     query_text: str,
     n_results: int = 5,
     where: Optional[Dict[str, Any]] = None,
+    vector_index=None,
 ) -> Dict[str, Any]:
     """Query a ChromaDB collection for similar documents.
     
@@ -111,19 +238,66 @@ def query_collection(
         query_text: Text to search for
         n_results: Number of results to return
         where: Optional filter to apply to the query
+        vector_index: Optional external reduced-precision index of the collection (see vector_index.py),
+            used instead of ChromaDB's index for unfiltered queries
         
     Returns:
         Query results containing documents, metadatas, distances, and ids
     """
+    return query_collection_batch(collection, [query_text], n_results=n_results, where=where, vector_index=vector_index)
+
+
+def query_collection_batch(
+    collection: chromadb.Collection,
+    query_texts: List[str],
+    n_results: int = 5,
+    where: Optional[Dict[str, Any]] = None,
+    vector_index=None,
+) -> Dict[str, Any]:
+    """Query a ChromaDB collection with several texts at once.
+    
+    All texts are embedded in one call to the embedding model and searched in a single
+    multi-query request.
+    
+    Args:
+        collection: ChromaDB collection
+        query_texts: Texts to search for
+        n_results: Number of results to return per text
+        where: Optional filter to apply to the query
+        vector_index: Optional external reduced-precision index of the collection (see vector_index.py),
+            used instead of ChromaDB's index for unfiltered queries
+        
+    Returns:
+        Query results containing one row of documents, metadatas, distances, and ids per text
+    """
+    if vector_index is not None and where is None:
+        return vector_index.query(collection, query_texts, n_results)
+
     # Query the collection
     return collection.query(
-        query_texts=[query_text],
+        query_texts=query_texts,
         n_results=n_results,
         where=where,
         include=["documents", "metadatas", "distances"]
     )
 
 
+def split_query_results(query_results: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Split multi-query results into single-query results.
+    
+    Args:
+        query_results: Results from a ChromaDB query with several query texts
+        
+    Returns:
+        One result per query text, each in the single-query format returned by query_collection
+    """
+    keys = [key for key in ("ids", "documents", "metadatas", "distances") if query_results.get(key) is not None]
+    return [
+        {key: [query_results[key][i]] for key in keys}
+        for i in range(len(query_results["ids"]))
+    ]
+
+
 def format_results_as_context(query_results: Dict[str, Any]) -> str:
     """Format query results as a context string for the agent.
     
@@ -0,0 +1,489 @@
+"""External reduced-precision vector index with full-precision re-scoring.
+
+The index keeps a compact copy of a collection's embeddings in memory, truncated or PCA-projected
+to fewer dimensions and stored as float16 or int8, and the normalized float32 embeddings in a
+memory-mapped file on disk. Queries scan the compact vectors for oversample * n_results candidates
+and re-score only those on the full-precision vectors, so query nodes hold a fraction of the
+float32 index in memory.
+
+Files of an index directory: meta.json (config and row count, written last and atomically on every
+change), ids.json, reduced.npy (compact vectors) and full.f32 (raw normalized float32 rows). Rows
+are only ever appended, and readers take the first meta.json count rows of each file, so an index
+can grow in place while it is being queried.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import chromadb
+import numpy as np
+
+from app.logging_config import logger
+from app.models import VectorStorageConfig
+from app.utils import get_embedding_function
+
+METADATA_PREFIX = "vectors:"
+PCA_SAMPLE_SIZE = 10000
+SCAN_BLOCK_ROWS = 65536
+
+
+def storage_metadata(config: VectorStorageConfig) -> Dict[str, Any]:
+    """Collection metadata entries recording a vector storage config."""
+    return {METADATA_PREFIX + key: value for key, value in config.model_dump().items() if value is not None}
+
+
+def storage_config_from_metadata(metadata: Optional[Dict[str, Any]]) -> Optional[VectorStorageConfig]:
+    """Vector storage config recorded in a collection's metadata, if any."""
+    values = {
+        key[len(METADATA_PREFIX):]: value
+        for key, value in (metadata or {}).items()
+        if key.startswith(METADATA_PREFIX)
+    }
+    return VectorStorageConfig(**values) if values else None
+
+
+def index_directory(root: str, collection_name: str) -> str:
+    """Directory holding the external index of a collection."""
+    return os.path.join(root, "vector_index", collection_name)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class Projection:
+    """Maps full embeddings to the compact representation: reduce, renormalize, quantize."""
+
+    def __init__(self, config: VectorStorageConfig, dims: int, mean: Optional[np.ndarray], components: Optional[np.ndarray], scale: Optional[np.ndarray]):
+        self.config = config
+        self.dims = dims
+        self.mean = mean
+        self.components = components
+        self.scale = scale
+
+    @classmethod
+    def fit(cls, config: VectorStorageConfig, sample: np.ndarray) -> "Projection":
+        """Fit PCA components and int8 scales on a sample of normalized embeddings."""
+        mean = components = scale = None
+        dims = min(config.dims or sample.shape[1], sample.shape[1])
+        if config.reduction == "pca":
+            mean = sample.mean(axis=0)
+            # Rows of vt are the principal axes, sorted by explained variance
+            _, _, vt = np.linalg.svd(sample - mean, full_matrices=False)
+            components = vt[:dims].astype(np.float32)
+            dims = components.shape[0]
+        projection = cls(config, dims, mean, components, None)
+        if config.dtype == "int8":
+            reduced = projection.reduce(sample)
+            projection.scale = (np.maximum(np.abs(reduced).max(axis=0), 1e-6) / 127.0).astype(np.float32)
+        return projection
+
+    def reduce(self, vectors: np.ndarray) -> np.ndarray:
+        """Reduce normalized float32 vectors to the compact dimensionality, renormalized."""
+        if self.components is not None:
+            reduced = (vectors - self.mean) @ self.components.T
+        else:
+            reduced = vectors[:, :self.dims]
+        return _normalize(reduced.astype(np.float32))
+
+    def quantize(self, reduced: np.ndarray) -> np.ndarray:
+        if self.config.dtype == "int8":
+            return np.clip(np.rint(reduced / self.scale), -127, 127).astype(np.int8)
+        return reduced.astype(self.config.dtype)
+
+    def dequantize(self, stored: np.ndarray) -> np.ndarray:
+        block = stored.astype(np.float32)
+        if self.scale is not None:
+            block *= self.scale
+        return block
+
+    def save(self, path: str) -> None:
+        arrays = {name: value for name, value in (("mean", self.mean), ("components", self.components), ("scale", self.scale)) if value is not None}
+        np.savez(path, dims=np.array(self.dims), **arrays)
+
+    @classmethod
+    def load(cls, config: VectorStorageConfig, path: str) -> "Projection":
+        with np.load(path) as arrays:
+            return cls(config, int(arrays["dims"]), arrays.get("mean"), arrays.get("components"), arrays.get("scale"))
+
+
+def ids_digest(ids: Iterable[str]) -> str:
+    """Order-independent digest of a set of record ids, stored in meta.json as the index's content version."""
+    digest = hashlib.sha1()
+    for record_id in sorted(ids):
+        digest.update(record_id.encode("utf-8") + b"\0")
+    return digest.hexdigest()
+
+
+def _write_atomic(path: str, write) -> None:
+    """Write a file through a temporary file and rename it into place."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def _write_meta(directory: str, meta: Dict[str, Any]) -> None:
+    _write_atomic(os.path.join(directory, "meta.json"), lambda f: f.write(json.dumps(meta).encode("utf-8")))
+
+
+class VectorIndex:
+    """Compact in-memory vectors plus memory-mapped full-precision vectors of one collection."""
+
+    def __init__(self, directory: str, ids: List[str], reduced: np.ndarray, full: np.ndarray, projection: Projection, embedding_model: str, meta: Dict[str, Any]):
+        self.directory = directory
+        self.ids = ids
+        self.reduced = reduced
+        self.full = full
+        self.projection = projection
+        self.embedding_model = embedding_model
+        self.meta = meta
+
+    @property
+    def config(self) -> VectorStorageConfig:
+        return self.projection.config
+
+    @property
+    def memory_bytes(self) -> int:
+        """Bytes held in memory by the compact vectors."""
+        return self.reduced.nbytes
+
+    @property
+    def full_precision_bytes(self) -> int:
+        """Bytes the float32 vectors would take in memory, for comparison."""
+        return self.full.shape[0] * self.full.shape[1] * 4
+
+    @classmethod
+    def build(
+        cls,
+        directory: str,
+        batches: Iterable[Tuple[List[str], np.ndarray]],
+        total: int,
+        dimension: int,
+        config: VectorStorageConfig,
+        embedding_model: str,
+        sample: np.ndarray,
+        collection_id: str = "",
+    ) -> "VectorIndex":
+        """Write an index from batches of (ids, embeddings) and swap it into place.
+
+        Args:
+            directory: Directory of the index, replaced once the new index is complete
+            batches: Batches of ids and raw embeddings, total rows in all
+            total: Number of rows to write; extra rows are ignored
+            dimension: Dimension of the raw embeddings
+            config: Vector storage config
+            embedding_model: Embedding model used to embed queries
+            sample: Sample of raw embeddings used to fit the projection
+            collection_id: Id of the indexed collection, which changes when it is recreated under the same name
+        """
+        projection = Projection.fit(config, _normalize(np.asarray(sample, dtype=np.float32)))
+        dims = projection.dims
+
+        staging = directory + ".building"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+
+        full = np.memmap(os.path.join(staging, "full.f32"), mode="w+", dtype=np.float32, shape=(total, dimension))
+        reduced = np.empty((total, dims), dtype=np.int8 if config.dtype == "int8" else config.dtype)
+        ids: List[str] = []
+        for batch_ids, embeddings in batches:
+            take = min(len(batch_ids), total - len(ids))
+            if take <= 0:
+                break
+            vectors = _normalize(np.asarray(embeddings[:take], dtype=np.float32))
+            full[len(ids):len(ids) + take] = vectors
+            reduced[len(ids):len(ids) + take] = projection.quantize(projection.reduce(vectors))
+            ids.extend(batch_ids[:take])
+        full.flush()
+        del full
+
+        count = len(ids)
+        np.save(os.path.join(staging, "reduced.npy"), reduced[:count])
+        projection.save(os.path.join(staging, "projection.npz"))
+        with open(os.path.join(staging, "ids.json"), "w") as f:
+            json.dump(ids, f)
+        _write_meta(staging, {
+            "config": config.model_dump(),
+            "embedding_model": embedding_model,
+            "count": count,
+            "dimension": dimension,
+            "collection_id": collection_id,
+            "ids_digest": ids_digest(ids),
+        })
+
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(staging, directory)
+        return cls.load(directory)
+
+    @classmethod
+    def load(cls, directory: str) -> "VectorIndex":
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        with open(os.path.join(directory, "ids.json")) as f:
+            ids = json.load(f)
+        config = VectorStorageConfig(**meta["config"])
+        count = meta["count"]
+        full = np.memmap(os.path.join(directory, "full.f32"), mode="r", dtype=np.float32, shape=(count, meta["dimension"]))
+        return cls(
+            directory,
+            ids[:count],
+            np.load(os.path.join(directory, "reduced.npy"))[:count],
+            full,
+            Projection.load(config, os.path.join(directory, "projection.npz")),
+            meta["embedding_model"],
+            meta,
+        )
+
+    def append(self, batches: Iterable[Tuple[List[str], np.ndarray]]) -> "VectorIndex":
+        """Append rows to the index in place, reduced with its existing projection.
+
+        Full-precision rows are written after the last committed row of full.f32, then the compact
+        vectors and ids are rewritten and meta.json is updated last. Readers holding the previous
+        version keep working, and an interrupted append leaves the previous version intact.
+
+        Returns:
+            The index reloaded with the new rows
+        """
+        ids = list(self.ids)
+        reduced = [self.reduced]
+        with open(os.path.join(self.directory, "full.f32"), "r+b") as f:
+            f.seek(len(ids) * self.full.shape[1] * 4)
+            for batch_ids, embeddings in batches:
+                vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+                f.write(vectors.tobytes())
+                reduced.append(self.projection.quantize(self.projection.reduce(vectors)))
+                ids.extend(batch_ids)
+            f.truncate()
+
+        _write_atomic(os.path.join(self.directory, "reduced.npy"), lambda f: np.save(f, np.concatenate(reduced)))
+        _write_atomic(os.path.join(self.directory, "ids.json"), lambda f: f.write(json.dumps(ids).encode("utf-8")))
+        _write_meta(self.directory, {**self.meta, "count": len(ids), "ids_digest": ids_digest(ids)})
+        return VectorIndex.load(self.directory)
+
+    def search(self, query_vectors: np.ndarray, n_results: int, oversample: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Find the nearest rows for each query.
+
+        The compact vectors are scanned block by block for the best oversample * n_results candidates,
+        which are then re-scored with the full-precision vectors.
+
+        Returns:
+            Row indices and cosine distances, both of shape (n_queries, n_results)
+        """
+        queries = _normalize(np.asarray(query_vectors, dtype=np.float32))
+        n_results = min(n_results, len(self.ids))
+        n_candidates = min(n_results * (oversample or self.config.oversample), len(self.ids))
+        reduced_queries = self.projection.reduce(queries)
+
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self.ids), SCAN_BLOCK_ROWS):
+            block = self.projection.dequantize(self.reduced[start:start + SCAN_BLOCK_ROWS])
+            scores = np.concatenate([best_scores, reduced_queries @ block.T], axis=1)
+            rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, start + len(block)), (len(queries), len(block)))], axis=1)
+            keep = np.argpartition(-scores, n_candidates - 1, axis=1)[:, :n_candidates] if scores.shape[1] > n_candidates else np.argsort(-scores, axis=1)
+            best_scores = np.take_along_axis(scores, keep, axis=1)
+            best_rows = np.take_along_axis(rows, keep, axis=1)
+
+        result_rows = np.empty((len(queries), n_results), dtype=np.int64)
+        result_distances = np.empty((len(queries), n_results), dtype=np.float32)
+        for i, (query, candidates) in enumerate(zip(queries, best_rows)):
+            # Sorted reads keep memory-mapped page access sequential
+            candidates = np.sort(candidates)
+            exact = self.full[candidates] @ query
+            order = np.argsort(-exact)[:n_results]
+            result_rows[i] = candidates[order]
+            result_distances[i] = 1 - exact[order]
+        return result_rows, result_distances
+
+    def query(self, collection: chromadb.Collection, query_texts: List[str], n_results: int) -> Dict[str, Any]:
+        """Query the index and return results in the same format as collection.query."""
+        embeddings = np.asarray(get_embedding_function(self.embedding_model)(query_texts), dtype=np.float32)
+        rows, distances = self.search(embeddings, n_results)
+
+        ids = [[self.ids[row] for row in query_rows] for query_rows in rows]
+        records = collection.get(ids=list({i for query_ids in ids for i in query_ids}), include=["documents", "metadatas"])
+        by_id = {i: (doc, meta) for i, doc, meta in zip(records["ids"], records["documents"], records["metadatas"])}
+
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for query_ids, query_distances in zip(ids, distances):
+            # Ids deleted from the collection since the index was built are skipped
+            found = [(i, d) for i, d in zip(query_ids, query_distances) if i in by_id]
+            results["ids"].append([i for i, _ in found])
+            results["documents"].append([by_id[i][0] for i, _ in found])
+            results["metadatas"].append([by_id[i][1] for i, _ in found])
+            results["distances"].append([float(d) for _, d in found])
+        return results
+
+
+def iter_embeddings(collection: chromadb.Collection, batch_size: int = 1000) -> Iterator[Tuple[List[str], np.ndarray]]:
+    """Yield a collection's ids and stored embeddings one batch at a time."""
+    offset = 0
+    while True:
+        batch = collection.get(limit=batch_size, offset=offset, include=["embeddings"])
+        if not len(batch["ids"]):
+            return
+        yield list(batch["ids"]), np.asarray(batch["embeddings"], dtype=np.float32)
+        offset += len(batch["ids"])
+
+
+def collection_ids(collection: chromadb.Collection, batch_size: int = 10000) -> List[str]:
+    """All ids of a collection, read without embeddings or documents."""
+    ids: List[str] = []
+    while True:
+        batch = collection.get(limit=batch_size, offset=len(ids), include=[])
+        if not len(batch["ids"]):
+            return ids
+        ids.extend(batch["ids"])
+
+
+def iter_embeddings_by_id(collection: chromadb.Collection, ids: List[str], batch_size: int = 1000) -> Iterator[Tuple[List[str], np.ndarray]]:
+    """Yield the stored embeddings of the given ids one batch at a time."""
+    for start in range(0, len(ids), batch_size):
+        batch = collection.get(ids=ids[start:start + batch_size], include=["embeddings"])
+        if len(batch["ids"]):
+            yield list(batch["ids"]), np.asarray(batch["embeddings"], dtype=np.float32)
+
+
+def build_vector_index(
+    collection: chromadb.Collection,
+    root: str,
+    config: VectorStorageConfig,
+    embedding_model: str,
+    batch_size: int = 1000,
+) -> Optional[VectorIndex]:
+    """(Re)build the external index of a collection from its stored embeddings.
+
+    Returns:
+        The new index, or None if the collection is empty
+    """
+    total = collection.count()
+    if not total:
+        return None
+
+    sample_ids: List[str] = []
+    sample_vectors = []
+    for batch_ids, embeddings in iter_embeddings(collection, batch_size=batch_size):
+        sample_ids.extend(batch_ids)
+        sample_vectors.append(embeddings)
+        if len(sample_ids) >= PCA_SAMPLE_SIZE:
+            break
+    sample = np.concatenate(sample_vectors)[:PCA_SAMPLE_SIZE]
+
+    index = VectorIndex.build(
+        index_directory(root, collection.name),
+        iter_embeddings(collection, batch_size=batch_size),
+        total,
+        sample.shape[1],
+        config,
+        embedding_model,
+        sample,
+        collection_id=str(collection.id),
+    )
+    _loaded.pop(index.directory, None)
+    return index
+
+
+def _stored_config(directory: str) -> Optional[VectorStorageConfig]:
+    try:
+        with open(os.path.join(directory, "meta.json")) as f:
+            return VectorStorageConfig(**json.load(f)["config"])
+    except OSError:
+        return None
+
+
+def sync_vector_index(collection: chromadb.Collection, root: str, embedding_model: str) -> Optional[VectorIndex]:
+    """Bring a collection's external index up to date after its contents changed.
+
+    The config comes from the collection's metadata (set when it was created with vector_storage)
+    or from an index previously built with index_tools.py. Collections with neither are skipped.
+
+    Records added since the index was built are appended to it, which reads only their embeddings.
+    The index is rebuilt from scratch when records were removed, the collection was recreated, or
+    the config or embedding model changed. Appended rows reuse the existing PCA projection and int8
+    scales; rebuild with index_tools.py quantize to refit them after the collection has grown a lot.
+
+    This is where the indexed ids are compared with the collection's, so every writer of a collection
+    with an external index must call it after writing (the crawl endpoint, insert_docs.py and
+    index_tools.py compact do). Queries only check the collection id and row count.
+    """
+    directory = index_directory(root, collection.name)
+    config = storage_config_from_metadata(collection.metadata) or _stored_config(directory)
+    if config is None:
+        return None
+
+    with _sync_locks.setdefault(directory, threading.Lock()):
+        try:
+            index = VectorIndex.load(directory)
+        except (OSError, KeyError, ValueError):
+            index = None
+
+        if (
+            index is not None
+            and index.config == config
+            and index.embedding_model == embedding_model
+            and index.meta.get("collection_id") == str(collection.id)
+        ):
+            current_ids = collection_ids(collection)
+            if ids_digest(current_ids) == index.meta.get("ids_digest"):
+                return index
+            indexed = set(index.ids)
+            if indexed.issubset(current_ids):
+                new_ids = [i for i in current_ids if i not in indexed]
+                if new_ids:
+                    index = index.append(iter_embeddings_by_id(collection, new_ids))
+                    _loaded.pop(directory, None)
+                return index
+
+        return build_vector_index(collection, root, config, embedding_model)
+
+
+def delete_vector_index(root: str, collection_name: str) -> None:
+    """Remove the external index of a collection, if it has one."""
+    directory = index_directory(root, collection_name)
+    _loaded.pop(directory, None)
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+# Serializes syncs of the same index within the process
+_sync_locks: Dict[str, threading.Lock] = {}
+
+# Loaded indexes, keyed by directory, with the modification time of their meta.json
+_loaded: Dict[str, Tuple[float, VectorIndex]] = {}
+_load_lock = threading.Lock()
+
+
+def load_vector_index(collection: chromadb.Collection, root: str) -> Optional[VectorIndex]:
+    """Get the up-to-date external index of a collection, or None if queries should go to ChromaDB.
+
+    None is returned when the collection has no external index, or the index was built for an
+    earlier collection of the same name or holds a different number of rows. Both checks are cheap;
+    the indexed ids are compared with the collection's by sync_vector_index, off the query path.
+    """
+    directory = index_directory(root, collection.name)
+    meta_path = os.path.join(directory, "meta.json")
+    try:
+        mtime = os.path.getmtime(meta_path)
+    except OSError:
+        return None
+
+    with _load_lock:
+        cached = _loaded.get(directory)
+        if cached is None or cached[0] != mtime:
+            try:
+                cached = (mtime, VectorIndex.load(directory))
+            except (OSError, KeyError, ValueError) as e:
+                logger.warning(f"External vector index of '{collection.name}' could not be loaded ({e}), querying ChromaDB instead")
+                return None
+            _loaded[directory] = cached
+    index = cached[1]
+
+    if index.meta.get("collection_id") != str(collection.id) or len(index.ids) != collection.count():
+        logger.warning(f"External vector index of '{collection.name}' is stale, querying ChromaDB instead")
+        return None
+    return index
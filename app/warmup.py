@@ -0,0 +1,88 @@
+"""Startup warm-up steps run from the application lifespan."""
+
+import inspect
+import time
+from typing import Dict
+
+from app.config import settings
+from app.logging_config import logger
+from app.utils import get_app_chroma_client, get_embedding_function
+
+
+def warm_embedding_model() -> None:
+    """Load the embedding model and run one inference so the first request does not pay for it."""
+    get_embedding_function(settings.EMBEDDING_MODEL)(["warm-up"])
+
+
+def warm_collections() -> None:
+    """Open the configured collections and query each once to load its index.
+
+    The query goes through the same retrieval path as chat requests, so collections with an external
+    reduced-precision index load only that index and never ChromaDB's full-precision HNSW index.
+    """
+    from app.retrieval import retrieve_many
+
+    client = get_app_chroma_client()
+    for name in settings.WARMUP_COLLECTIONS:
+        try:
+            collection = client.get_collection(name=name, embedding_function=get_embedding_function(settings.EMBEDDING_MODEL))
+        except Exception as e:
+            logger.warning(f"Warm-up skipped collection '{name}': {e}")
+            continue
+        if collection.count() > 0:
+            retrieve_many(collection, ["warm-up"], top_k=1, rerank=False)
+
+
+def warm_rerank_model() -> None:
+    """Load the cross-encoder used for reranking."""
+    from app.rerank import get_cross_encoder
+
+    get_cross_encoder(settings.RERANK_MODEL).predict([("warm-up", "warm-up")], show_progress_bar=False)
+
+
+async def warm_browser() -> None:
+    """Launch and close the headless browser once, so a broken browser install fails at startup
+    and the browser binaries are in the OS page cache for the first crawl."""
+    from crawl4ai import AsyncWebCrawler, BrowserConfig
+
+    async with AsyncWebCrawler(config=BrowserConfig(headless=True, verbose=False)):
+        pass
+
+
+async def run_warmup(serves_crawl: bool, serves_chat: bool) -> Dict[str, float]:
+    """Run the warm-up steps enabled in the settings for the routers being served.
+
+    A failing step is logged and does not prevent startup.
+
+    Args:
+        serves_crawl: Whether the crawl router is served by this process
+        serves_chat: Whether the chat router is served by this process
+
+    Returns:
+        Duration of each step that ran, in seconds
+    """
+    steps = []
+    if settings.WARMUP_EMBEDDING_MODEL:
+        steps.append(("embedding_model", warm_embedding_model))
+    if settings.WARMUP_COLLECTIONS and serves_chat:
+        steps.append(("collections", warm_collections))
+    if settings.RERANK_ENABLED and serves_chat:
+        steps.append(("rerank_model", warm_rerank_model))
+    if settings.WARMUP_BROWSER and serves_crawl:
+        steps.append(("browser", warm_browser))
+
+    timings = {}
+    for name, step in steps:
+        start = time.perf_counter()
+        try:
+            if inspect.iscoroutinefunction(step):
+                await step()
+            else:
+                step()
+        except Exception as e:
+            logger.warning(f"Warm-up step '{name}' failed: {e}")
+            continue
+        timings[name] = time.perf_counter() - start
+        logger.info(f"Warm-up '{name}' done in {timings[name]:.2f}s")
+
+    return timings